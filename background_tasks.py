@@ -0,0 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor
+import secrets
+import threading
+import time
+from metrics import request_id, traced
+
+# Number of data collections running at the same time in the background
+MAX_BACKGROUND_TASKS = 8
+
+# Seconds a finished task is kept so that the browser can fetch its result
+TASK_RETENTION = 600
+
+
+# Raised inside a task that was cancelled, to stop it at the next check
+class TaskCancelled(Exception):
+    pass
+
+
+# A function running in the background, with its progress (steps done out of the total) and a cancellation flag.
+# The function receives the task and calls check() regularly so that it stops soon after being cancelled.
+# With a shared state (a diskcache.Cache), the task publishes its owner, progress and outcome there under ('task', id),
+# and also stops when another worker process sets ('cancelled', id).
+class Task:
+    def __init__(self, owner=None, request=None, shared=None):
+        self.id = secrets.token_urlsafe(16)
+        self.owner = owner
+        # Id of the request that started the task, used in the trace logs
+        self.request = request
+        self.future = None
+        self.finished_at = None
+        self.done_steps = 0
+        self.total_steps = 0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._shared = shared
+
+    def add_steps(self, steps):
+        with self._lock:
+            self.total_steps += steps
+            self._publish('running')
+
+    def advance(self):
+        with self._lock:
+            self.done_steps += 1
+            self._publish('running')
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        if self._shared is not None and self._shared.get(('cancelled', self.id)):
+            self._cancelled.set()
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    # This function saves the state of the task for the other worker processes. The record expires if the process
+    # stops updating it, so that a task lost with its process is started again.
+    def _publish(self, state, error=None):
+        if self._shared is not None:
+            record = {'owner': self.owner, 'state': state, 'error': error,
+                      'done_steps': self.done_steps, 'total_steps': self.total_steps}
+            self._shared.set(('task', self.id), record, expire=TASK_RETENTION)
+
+
+# A task running in another worker process, seen through the record it publishes in the shared state.
+# Its result is not sent back: the function saves it where every process can read it (the usage cache and the local store).
+class RemoteTask:
+    def __init__(self, task_id, record, shared):
+        self.id = task_id
+        self.owner = record['owner']
+        self.done_steps = record['done_steps']
+        self.total_steps = record['total_steps']
+        self._record = record
+        self._shared = shared
+
+    def cancel(self):
+        self._shared.set(('cancelled', self.id), True, expire=TASK_RETENTION)
+
+    def done(self):
+        return self._record['state'] != 'running'
+
+    def result(self):
+        if self._record['state'] == 'failed':
+            raise RuntimeError(self._record['error'])
+        return None
+
+
+# Runs tasks on a thread pool and keeps them by id so that their progress and result can be polled.
+# With a shared state, the tasks of the other worker processes can be polled and cancelled too.
+class TaskRunner:
+    def __init__(self, max_workers=MAX_BACKGROUND_TASKS, shared=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._shared = shared
+
+    # This function starts fn(*args, task=task, **kwargs) in the background and returns the task
+    def submit(self, owner, fn, *args, **kwargs):
+        self._forget_finished()
+        task = Task(owner, request_id(), self._shared)
+        task._publish('running')
+        with self._lock:
+            self._tasks[task.id] = task
+        task.future = self._executor.submit(self._run, task, fn, *args, **kwargs)
+        task.future.add_done_callback(lambda future: self._finish(task, future))
+        return task
+
+    def _run(self, task, fn, *args, **kwargs):
+        with traced(task.request):
+            return fn(*args, task=task, **kwargs)
+
+    def _finish(self, task, future):
+        task.finished_at = time.monotonic()
+        error = None if future.cancelled() else future.exception()
+        task._publish('failed' if future.cancelled() or error else 'done', str(error) if error else None)
+
+    # This function returns the task with this id if it belongs to the owner, whichever worker process runs it
+    def get(self, task_id, owner):
+        with self._lock:
+            task = self._tasks.get(task_id)
+        if task is None and self._shared is not None:
+            record = self._shared.get(('task', task_id))
+            task = RemoteTask(task_id, record, self._shared) if record else None
+        if task is None or task.owner != owner:
+            return None
+        return task
+
+    def cancel(self, task_id, owner):
+        task = self.get(task_id, owner)
+        if task:
+            task.cancel()
+
+    def _forget_finished(self):
+        now = time.monotonic()
+        with self._lock:
+            for task_id in [task_id for task_id, task in self._tasks.items()
+                            if task.finished_at is not None and now - task.finished_at > TASK_RETENTION]:
+                del self._tasks[task_id]
@@ -0,0 +1,288 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from metrics import span_seconds
+from collect_data import SACCT_FIELDS, ALL_USERS, stream_sacct, expand_jobs, rollup_daily_usage, rollup_gpu_usage, breakdown_by, split_jobs_by_day, expand_job, parse_sacct_output
+
+# Number of sacct lines generated for each benchmark scale: the allocation line of each job and its step lines
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+
+# Average number of sacct lines per generated job: its allocation line, the batch and extern steps of the jobs
+# that started (99%), and an srun step for half of them
+LINES_PER_JOB = 1 + 0.99 * 2.5
+
+# GPU entries of the AllocTRES of the generated jobs, with their probabilities
+GPU_TRES_CHOICES = ['', ',gres/gpu=1', ',gres/gpu=2', ',gres/gpu=4', ',gres/gpu:a100=4,gres/gpu=4', ',gres/gpu:v100=2,gres/gpu=2']
+GPU_TRES_WEIGHTS = [0.6, 0.15, 0.1, 0.05, 0.05, 0.05]
+
+# Maximum seconds to import app.py and serve the login page from a fresh process
+STARTUP_BUDGET_S = 1.0
+
+# Modules only loaded with the dashboard, on its first request: the login pages must not import them
+DASHBOARD_MODULES = ['dash', 'plotly', 'pandas', 'dash_daq', 'dash_bootstrap_components', 'dash_bootstrap_templates']
+
+# Measured in a fresh interpreter, since this script imports pandas itself
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/')
+served = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+client.get('/dashboard/')
+print(json.dumps({'import_s': round(imported - started, 4), 'login_page_s': round(served - started, 4),
+                  'first_dashboard_request_s': round(time.perf_counter() - served, 4), 'dashboard_modules_loaded': loaded}))
+''' % DASHBOARD_MODULES
+
+
+# Function to format durations in seconds as sacct does, e.g. '1-02:03:04' or '02:03:04'
+def format_sacct_durations(seconds):
+    seconds = pd.Series(seconds, dtype=np.int64)
+    clock = ((seconds % 86400 // 3600).astype(str).str.zfill(2) + ':' + (seconds % 3600 // 60).astype(str).str.zfill(2)
+             + ':' + (seconds % 60).astype(str).str.zfill(2))
+    return clock.where(seconds < 86400, (seconds // 86400).astype(str) + '-' + clock).to_numpy(dtype=object)
+
+
+# Function to generate realistic output of the sacct command built by sacct_command, without header: the allocation
+# line of each job followed by its step lines (batch and extern, and an srun step for half of the jobs), about
+# STEP_LINES_PER_JOB lines per job. Durations are log-normal, some jobs span several days and some never started
+# (Start = Unknown, no run time, no steps). The steps measure the CPU time used and, for GPU jobs, the GPU utilization.
+def generate_sacct_output(rows, users=50, accounts=10, days=365, multi_day=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    jobs = max(round(rows / LINES_PER_JOB), 1)
+    period_end = np.datetime64('2024-12-31T00:00:00')
+
+    start = period_end - rng.integers(0, days * 86400, jobs).astype('timedelta64[s]')
+    duration = np.exp(rng.normal(7.5, 1.5, jobs)).astype(np.int64)
+    long_jobs = rng.random(jobs) < multi_day
+    duration[long_jobs] = rng.integers(86400, 7 * 86400, long_jobs.sum())
+
+    start_str = np.datetime_as_string(start, unit='s').astype(object)
+    never_started = rng.random(jobs) < 0.01
+    start_str[never_started] = 'Unknown'
+    duration[never_started] = 0
+
+    user_ids = rng.integers(0, users, jobs)
+    cpus = 2 ** rng.integers(0, 7, jobs)
+    gpu_tres = rng.choice(GPU_TRES_CHOICES, jobs, p=GPU_TRES_WEIGHTS)
+    tres = ('cpu=' + pd.Series(cpus).astype(str) + ',mem=' + pd.Series(cpus * 4).astype(str) + 'G,node=1,billing='
+            + pd.Series(cpus).astype(str) + gpu_tres)
+    # Submitted up to a few hours before starting
+    submit = np.datetime_as_string(start - rng.exponential(3600, jobs).astype('timedelta64[s]'), unit='s')
+
+    job_ids = np.arange(1_000_000, 1_000_000 + jobs).astype(str).astype(object)
+    allocations = pd.DataFrame({
+        'JobID': job_ids,
+        'User': np.char.add('user', user_ids.astype(str)).astype(object),
+        'Account': np.char.add('account', (user_ids % accounts).astype(str)).astype(object),
+        'AllocCPUS': cpus,
+        'AllocTRES': tres,
+        'Start': start_str,
+        'ElapsedRaw': duration,
+        'Submit': submit,
+        'TotalCPU': '',
+        'TRESUsageInAve': '',
+    })
+
+    # CPU time used by the tasks, out of the allocated CPU time, split between the batch step and the srun step
+    cpu_time = (cpus * duration * rng.uniform(0.05, 1, jobs)).astype(np.int64)
+    has_srun = rng.random(jobs) < 0.5
+    srun_cpu_time = np.where(has_srun, cpu_time // 2, 0)
+    has_gpus = gpu_tres != ''
+    gpu_utilization = rng.integers(0, 101, jobs).astype(str).astype(object)
+
+    def steps(name, selected, elapsed, used, usage):
+        return allocations[selected].assign(
+            JobID=job_ids[selected] + '.' + name, User='', Submit=allocations['Start'][selected], ElapsedRaw=elapsed[selected],
+            TotalCPU=format_sacct_durations(used[selected]), TRESUsageInAve=usage[selected])
+
+    cpu_usage = 'cpu=' + format_sacct_durations(cpu_time - srun_cpu_time) + ',mem=1128K'
+    srun_usage = 'cpu=' + format_sacct_durations(srun_cpu_time) + ',mem=12G'
+    started = ~never_started
+    lines = [
+        allocations.assign(Order=0),
+        steps('batch', started, duration, cpu_time - srun_cpu_time,
+              np.where(has_gpus, cpu_usage + ',gres/gpuutil=' + gpu_utilization, cpu_usage)).assign(Order=1),
+        steps('extern', started, duration, np.zeros(jobs, dtype=np.int64),
+              np.where(has_gpus, 'cpu=00:00:00,gres/gpuutil=0', 'cpu=00:00:00')).assign(Order=2),
+        steps('0', started & has_srun, duration // 2, srun_cpu_time,
+              np.where(has_gpus, srun_usage + ',gres/gpuutil=' + gpu_utilization, srun_usage)).assign(Order=3),
+    ]
+    # sacct prints the steps of a job right after its allocation line
+    output = pd.concat(lines).rename_axis('Job').sort_values(['Job', 'Order'], kind='stable')[SACCT_FIELDS]
+
+    return output.to_csv(sep='|', index=False, header=False)
+
+
+# Stand-in for paramiko.SSHClient: exec_command returns the generated output as stdout
+class FakeSSHClient:
+    def __init__(self, output):
+        self.output = output.encode()
+        self.bytes_sent = 0
+
+    def exec_command(self, command):
+        self.bytes_sent += len(self.output)
+        return io.BytesIO(), FakeChannelFile(self.output), io.BytesIO()
+
+
+# Output of a command that exited successfully, like the stdout returned by paramiko
+class FakeChannelFile(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.channel = self
+
+    def recv_exit_status(self):
+        return 0
+
+
+# Peak resident set size of this process, in bytes
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if platform.system() == 'Darwin' else usage * 1024
+
+
+# Function to run the parse -> steps -> split -> aggregate pipeline on generated output and measure each stage
+def run_pipeline(rows, seed=0):
+    output = generate_sacct_output(rows, seed=seed)
+    ssh = FakeSSHClient(output)
+    baseline_rss = peak_rss()
+
+    timings = {'parse': 0.0, 'steps': 0.0, 'split': 0.0, 'aggregate': 0.0}
+    step_seconds = span_seconds('step_usage')
+    rollups = []
+    jobs_parsed = 0
+    job_days = 0
+    started = time.perf_counter()
+
+    batches = stream_sacct(ssh, ALL_USERS, datetime(2024, 1, 1), datetime(2024, 12, 31))
+    while True:
+        t0 = time.perf_counter()
+        jobs = next(batches, None)
+        timings['parse'] += time.perf_counter() - t0
+        if jobs is None:
+            break
+        jobs_parsed += len(jobs)
+
+        t0 = time.perf_counter()
+        expanded = expand_jobs(jobs)
+        timings['split'] += time.perf_counter() - t0
+        job_days += len(expanded)
+
+        t0 = time.perf_counter()
+        rollups.append(rollup_daily_usage(expanded))
+        rollup_gpu_usage(expanded)
+        timings['aggregate'] += time.perf_counter() - t0
+
+    # The step lines are summed per job while each batch is parsed
+    timings['steps'] = span_seconds('step_usage') - step_seconds
+    timings['parse'] -= timings['steps']
+
+    # Batches are summed together, then broken down like the cluster-wide graph does
+    t0 = time.perf_counter()
+    daily_usage = pd.concat(rollups).groupby(['User', 'Account', 'Date']).sum().reset_index()
+    breakdown_by(daily_usage, 'User', ['CPUSeconds', 'GPUSeconds'])
+    timings['aggregate'] += time.perf_counter() - t0
+
+    wall_time = time.perf_counter() - started
+    return {
+        'rows': rows,
+        'bytes': len(ssh.output),
+        'jobs': jobs_parsed,
+        'job_days': job_days,
+        'daily_rows': len(daily_usage),
+        'wall_time_s': round(wall_time, 4),
+        'stages_s': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        'rows_per_s': round(rows / wall_time),
+        'peak_rss_bytes': peak_rss(),
+        'baseline_rss_bytes': baseline_rss,
+    }
+
+
+# Function to check that the vectorized day split gives the same rows as the row-by-row expand_job
+def check_parity(rows=20_000, seed=0):
+    jobs = parse_sacct_output(generate_sacct_output(rows, seed=seed)).reset_index(drop=True)
+    vectorized = split_jobs_by_day(jobs)
+
+    reference = pd.DataFrame([item for _, row in jobs.iterrows() for item in expand_job(row)])
+    reference['Date'] = pd.to_datetime(reference['Date'])
+    reference['ElapsedSeconds'] = reference['ElapsedTime'].dt.total_seconds().astype(np.int64)
+
+    columns = ['JobID', 'Date', 'ElapsedSeconds', 'NumGPUs']
+    pd.testing.assert_frame_equal(vectorized[columns], reference[columns], check_dtype=False)
+    return len(vectorized)
+
+
+# Function to profile the startup of a worker: importing app.py and serving the login page, then the first dashboard request.
+# It returns the profile and the list of budget violations.
+def profile_startup():
+    completed = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    profile = json.loads(completed.stdout.strip().splitlines()[-1])
+    violations = []
+    if profile['login_page_s'] > STARTUP_BUDGET_S:
+        violations.append(f"login page served after {profile['login_page_s']} s, over the budget of {STARTUP_BUDGET_S} s")
+    if profile['dashboard_modules_loaded']:
+        violations.append(f"login page loaded {', '.join(profile['dashboard_modules_loaded'])}")
+    return profile, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sacct parse -> steps -> split -> aggregate pipeline on synthetic data")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help="number of sacct lines (jobs and steps) of each run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file the results are written to")
+    parser.add_argument('--check', action='store_true', help="also check the vectorized day split against expand_job")
+    parser.add_argument('--startup', action='store_true',
+                        help="only profile the startup of the app, and fail if it is over the import-time budget")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup:
+        profile, violations = profile_startup()
+        print(f"Import: {profile['import_s']} s, login page: {profile['login_page_s']} s, "
+              f"first dashboard request: {profile['first_dashboard_request_s']} s")
+        for violation in violations:
+            print(f"FAIL: {violation}")
+        sys.exit(1 if violations else 0)
+
+    # Each scale runs in its own process so that its peak RSS is measured on its own
+    if args.single:
+        print(json.dumps(run_pipeline(args.single, args.seed)))
+        return
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'runs': [],
+    }
+    if args.check:
+        results['parity_rows'] = check_parity(seed=args.seed)
+        print(f"Parity with expand_job: OK ({results['parity_rows']} job-days)")
+
+    for rows in args.scales:
+        completed = subprocess.run([sys.executable, __file__, '--single', str(rows), '--seed', str(args.seed)],
+                                   capture_output=True, text=True, check=True)
+        run = json.loads(completed.stdout)
+        results['runs'].append(run)
+        print(f"{rows:>10} rows: {run['wall_time_s']:8.3f} s, {run['rows_per_s']:>10} rows/s, "
+              f"peak RSS {run['peak_rss_bytes'] / 2**20:8.1f} MiB  {run['stages_s']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
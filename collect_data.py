@@ -1,110 +1,462 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import csv
+import io
+import shlex
+import threading
+import numpy as np
 import pandas as pd
 import os
+from background_tasks import Task
+from metrics import span, count, traced
+from shared_state import open_shared_slots
+from ssh_connection import check_exit_status
+from usage_cache import open_usage_cache, RECENT_TTL
+from usage_store import UsageStore, login_db_path
+
+# Fields requested from sacct, in output order. ElapsedRaw is the run time in seconds, so End is Start + ElapsedRaw
+# and only Start and Submit have to be parsed as dates. TotalCPU (CPU time used by the tasks) and TRESUsageInAve (which
+# holds the GPU utilization, gres/gpuutil, on clusters that gather it) are measured per step: they are read from the step
+# lines (e.g. '123.batch', '123.0') that sacct prints after the allocation line of each job, and summed per job.
+SACCT_FIELDS = ['JobID', 'User', 'Account', 'AllocCPUS', 'AllocTRES', 'Start', 'ElapsedRaw', 'Submit', 'TotalCPU', 'TRESUsageInAve']
+
+# Numeric fields, parsed as numbers by the CSV reader (as floats, so that an empty value becomes NaN)
+SACCT_NUMERIC_FIELDS = ['AllocCPUS', 'ElapsedRaw']
+SACCT_DTYPES = {field: 'float64' if field in SACCT_NUMERIC_FIELDS else str for field in SACCT_FIELDS}
+
+# Value of the user selection meaning every user of the cluster, fetched in a single sacct pass with --allusers
+ALL_USERS = '*'
+
+# Multipliers converting the memory of a TRES string (e.g. mem=16G) to megabytes. Values without unit are in megabytes
+MEMORY_UNITS = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 ** 2, 'P': 1024 ** 3}
+
+# Columns parsed from the AllocTRES of each job
+TRES_COLUMNS = ['MemMB', 'NumNodes', 'Billing', 'NumGPUs']
+
+# Model of the GPUs whose type is not given in AllocTRES (gres/gpu=N without a matching gres/gpu:<model>=N)
+UNTYPED_GPU_MODEL = 'untyped'
+
+# Prefix of the columns holding the GPU seconds of each GPU model in the daily usage
+GPU_MODEL_PREFIX = 'GPUSeconds:'
+
+# Maximum number of bars of each trace of the graph. Longer periods are shown by week, month or year,
+# so that the size of the figure sent to the browser does not grow with the length of the period
+MAX_BARS = 120
+
+# Bar sizes of the graph, from the finest to the coarsest: pandas period frequency, name, and maximum number of days
+RESOLUTIONS = [('D', 'Daily', 1), ('W', 'Weekly', 7), ('M', 'Monthly', 31), ('Y', 'Yearly', 366)]
+
+# Daily usage columns that are numbers of resources rather than times: when days are binned together,
+# they are averaged over the days of the bin instead of summed
+COUNT_COLUMNS = ['AllocCPUS', 'NumGPUs']
+
+# Number of users or accounts shown separately in the cluster-wide breakdown; the others are summed together
+TOP_N = 10
+
+# Graph types computed from the individual jobs of the period, read from the local store, instead of their daily usage
+JOB_STATISTICS_GRAPHS = ['efficiency', 'wait_time', 'durations']
+
+# Percentiles of the wait times and job durations of each user or account
+PERCENTILES = [0.5, 0.95]
+
+# Bins of the job duration histogram, in seconds, and their labels. Longer jobs are counted in the last bin
+DURATION_BIN_EDGES = [0, 60, 600, 3600, 4 * 3600, 12 * 3600, 86400, 3 * 86400, 7 * 86400, 30 * 86400]
+DURATION_BIN_LABELS = ['< 1 min', '1-10 min', '10 min-1 h', '1-4 h', '4-12 h', '12 h-1 day', '1-3 days', '3-7 days', '> 7 days']
+
+# Number of bytes of sacct output read and parsed at a time. Peak memory depends on this, not on the timeframe length
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Long periods are fetched as several sacct queries of at most SYNC_CHUNK_DAYS days each, run in parallel
+SYNC_CHUNK_DAYS = 30
+
+# Maximum number of sacct queries running at the same time, over all sessions and worker processes, so that slurmdbd is not overloaded
+MAX_PARALLEL_QUERIES = int(os.environ.get('SLURM_DASHBOARD_MAX_QUERIES', 4))
+sacct_slots = open_shared_slots('sacct_slots', MAX_PARALLEL_QUERIES)
+
+# Job states after which a job record never changes again
+FINAL_JOB_STATES = 'BF,CA,CD,DL,F,NF,OOM,PR,TO'
+
+# Local stores of finished jobs, one per login. sacct only lists the jobs a login is allowed to see (PrivateData),
+# so the jobs fetched with one login are never served to another, and a period synced by a less privileged login
+# is not marked as synced for the others.
+stores = {}
+stores_lock = threading.Lock()
+
+
+# Function to get the local store of a login, opening it on first use
+def store_of(login):
+    with stores_lock:
+        if login not in stores:
+            stores[login] = UsageStore(login_db_path(login))
+        return stores[login]
+
+# Cache of per-day aggregates, keyed by (user, start day, end day)
+daily_usage_cache = open_usage_cache()
+
+
+# This function calculates the start and end dates of the period covering the last days days
+def days_based_period(days=30):
 
-# Function to extract GPU count
-def extract_gpu_count(gres_value):
-    if pd.isna(gres_value):
-        return 0
-    elif 'gpu:' in gres_value:
-        return int(gres_value.split(':')[-1])
-    else:
-        return 0
-    
-    
-# This function calculates the start and end times based on the number of days specified.
-# It constructs and executes an sacct command to collect data for a specified user within the timeframe. 
-def collect_data_days_based(ssh, user, days=30):
-    
     # Calculate start and end times for the specified duration
     end_time = datetime.now()
     start_time = end_time - timedelta(days=days)
-    start_time_str = start_time.strftime('%Y-%m-%d')
-    end_time_str = end_time.strftime('%Y-%m-%d')
+    return start_time.strftime('%Y-%m-%d'), end_time.strftime('%Y-%m-%d')
 
-    # Construct and execute the data collection command
-    command = f"sacct -P -o JobID,User,AllocCPUS,AllocGRES,Start,End --user={user} --starttime={start_time_str} --endtime={end_time_str}"
-    stdin, stdout, stderr = ssh.exec_command(command)
-    result = stdout.read().decode()
-    
-    # Define the expected header
-    expected_header = "JobID|User|AllocCPUS|AllocGRES|Start|End"
 
-    # Check if result contains only the header (i.e. if the result is empty)
-    if result.strip() == expected_header: 
-        return pd.DataFrame() 
+# This function converts the start and end dates picked in the dashboard to 'YYYY-MM-DD' strings
+def datetime_based_period(start_date, end_date):
+    start_date = datetime.strptime(start_date[:10], "%Y-%m-%d").strftime('%Y-%m-%d')
+    end_date = datetime.strptime(end_date[:10], "%Y-%m-%d").strftime('%Y-%m-%d')
+    return start_date, end_date
 
-    return preprocess_data(result)
 
+# This function returns the daily usage of a specified user within the last days days
+def collect_data_days_based(ssh, user, days=30, task=None):
+    return collect_daily_usage(ssh, user, *days_based_period(days), task=task)
 
-# This function constructs and executes an sacct command to collect data for a specified user within the period [start_date, end_date]
-def collect_data_datetime_based(ssh, user, start_date, end_date):
-    
-    # Convert start and end dates from string to datetime
-    start_date = datetime.strptime(start_date[:10], "%Y-%m-%d").strftime('%Y-%m-%d')
-    end_date = datetime.strptime(end_date[:10], "%Y-%m-%d").strftime('%Y-%m-%d')
 
-    # Construct and execute the data collection command
-    command = f"sacct -P -o JobID,User,AllocCPUS,AllocGRES,Start,End --user={user} --starttime={start_date} --endtime={end_date}"
-    stdin, stdout, stderr = ssh.exec_command(command)
-    result = stdout.read().decode()
-    
-    # Define the expected header
-    expected_header = "JobID|User|AllocCPUS|AllocGRES|Start|End"
- 
-    # Check if result contains only the header (i.e. if the result is empty)
-    if result.strip() == expected_header: 
-        return pd.DataFrame() 
+# This function returns the daily usage of a specified user within the period [start_date, end_date]
+def collect_data_datetime_based(ssh, user, start_date, end_date, task=None):
+    return collect_daily_usage(ssh, user, *datetime_based_period(start_date, end_date), task=task)
+
+
+# This function returns the per-day usage of the period [start_date, end_date], from the cache when possible.
+# The GPU seconds of each GPU model are in the GPUSeconds:<model> columns.
+# Periods covering today are refreshed after RECENT_TTL seconds. Periods that end before today do not expire, but a job
+# still running during the period is only saved once it ends: the periods covering the days of the jobs added to the store
+# are then invalidated (see invalidate_cached_usage).
+# When a background task is given, its progress is updated and the collection stops if it is cancelled.
+# The usage is that of the jobs the login of the SSH connection can see.
+def collect_daily_usage(ssh, user, start_date, end_date, task=None):
+    login = ssh.username
+    daily_usage = cached_daily_usage(login, user, start_date, end_date)
+    if daily_usage is not None:
+        return daily_usage
+
+    # Bring the local store up to date for the user and read the period from its daily rollup.
+    # The generation is read after the sync so that the invalidations of its own jobs do not count.
+    with span('sync'):
+        sync_user_jobs(ssh, user, datetime.strptime(start_date, "%Y-%m-%d"), task or Task())
+    generation = daily_usage_cache.generation()
+    with span('load_daily_usage'):
+        daily_usage = load_daily_usage(login, user, start_date, end_date)
+
+    # A period loaded while jobs were added by another sync may miss them, so it is not kept for good
+    final = end_date < datetime.now().strftime('%Y-%m-%d') and daily_usage_cache.generation() == generation
+    daily_usage_cache.put((login, user, start_date, end_date), daily_usage, ttl=None if final else RECENT_TTL)
+    return daily_usage
+
+
+# This function returns the per-day usage of the period [start_date, end_date] cached for a login, or None
+def cached_daily_usage(login, user, start_date, end_date):
+    return daily_usage_cache.get((login, user, start_date, end_date))
+
+
+# This function drops the cached periods of a login that include a day of the daily usage just added to its store,
+# for the users of that usage and for the cluster-wide view
+def invalidate_cached_usage(login, daily_usage):
+    if daily_usage.empty:
+        return
+    users = set(daily_usage['User'].unique()) | {ALL_USERS}
+    first_day = daily_usage['Date'].min().strftime('%Y-%m-%d')
+    last_day = daily_usage['Date'].max().strftime('%Y-%m-%d')
+    daily_usage_cache.invalidate(lambda key: key[0] == login and key[1] in users and key[2] <= last_day and key[3] >= first_day)
+
+
+# This function reads the per-day usage of the period [start_date, end_date] from the local store of a login, without syncing it.
+# While a sync is running, it returns the usage of the jobs saved so far. The usage of a user is summed over its accounts
+# unless by_account is set; the usage of every user is always given per user and account.
+def load_daily_usage(login, user, start_date, end_date, by_account=False):
+    store = store_of(login)
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    if user == ALL_USERS or by_account:
+        daily_usage = store.load_cluster_daily_usage(start, end, None if user == ALL_USERS else user)
+        gpu_usage = store.load_cluster_gpu_usage(start, end, None if user == ALL_USERS else user)
+        return add_gpu_model_columns(daily_usage, gpu_usage, ['Date', 'User', 'Account'])
+    daily_usage = store.load_daily_usage(user, start, end)
+    gpu_usage = store.load_gpu_usage(user, start, end)
+    return add_gpu_model_columns(daily_usage, gpu_usage, ['Date'])
+
+
+# This function adds the GPU seconds of each model (gpu_usage, one row per key and model) to the daily usage,
+# as one GPUSeconds:<model> column per model
+def add_gpu_model_columns(daily_usage, gpu_usage, keys):
+    if gpu_usage.empty:
+        return daily_usage
+    models = gpu_usage.pivot_table(index=keys, columns='Model', values='GPUSeconds', aggfunc='sum', fill_value=0)
+    models.columns = [GPU_MODEL_PREFIX + model for model in models.columns]
+    daily_usage = daily_usage.merge(models.reset_index(), on=keys, how='left')
+    daily_usage[models.columns] = daily_usage[models.columns].fillna(0).astype(np.int64)
+    return daily_usage
+
+
+# This function fetches the finished jobs missing from the local store of the SSH login for a user, from start up to now.
+# Only the jobs that finished since the last sync (or before the earliest synced day) are fetched over SSH,
+# and only the jobs that are new to the store are added to the daily rollup.
+# Long periods are split into chunks fetched concurrently over the channels of the session's SSH connections;
+# each chunk is a step of the task.
+def sync_user_jobs(ssh, user, start, task):
+    store = store_of(ssh.username)
+    with store.sync_lock(user):
+        now = datetime.now()
+        ranges = [(range_start, range_end, split_period(range_start, range_end, SYNC_CHUNK_DAYS))
+                  for range_start, range_end in store.missing_ranges(user, start, now)]
+        task.add_steps(sum(len(chunks) for range_start, range_end, chunks in ranges))
+
+        for range_start, range_end, chunks in ranges:
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL_QUERIES) as executor:
+                # list() re-raises the error of any failed or cancelled chunk, in which case the period is not marked as synced
+                list(executor.map(lambda chunk: fetch_jobs(ssh, user, *chunk, task), chunks))
+            store.mark_synced(user, range_start, range_end)
+
+
+# This function splits the period [start, end] into consecutive periods of at most days days
+def split_period(start, end, days):
+    chunks = []
+    while start < end:
+        chunk_end = min(start + timedelta(days=days), end)
+        chunks.append((start, chunk_end))
+        start = chunk_end
+    return chunks or [(start, end)]
+
+
+# This function fetches the finished jobs of the period [start, end] and saves the new ones, batch by batch.
+# A job that ends on the boundary of two chunks is returned by both queries; saving is serialized
+# so that it is added to the store and to the daily rollup only once.
+def fetch_jobs(ssh, user, start, end, task):
+    store = store_of(ssh.username)
+    task.check()
+    with sacct_slots, traced(task.request):
+        for jobs in stream_sacct(ssh, user, start, end, states=FINAL_JOB_STATES):
+            task.check()
+            # Each batch of jobs is split into days and rolled up as soon as it is read
+            with store.writing() as conn:
+                with span('dedup'):
+                    jobs = store.new_jobs(jobs, conn)
+                with span('split'):
+                    expanded = expand_jobs(jobs)
+                count('rows', len(expanded), stage='split')
+                with span('rollup'):
+                    daily_usage = rollup_daily_usage(expanded)
+                    gpu_usage = rollup_gpu_usage(expanded)
+                with span('store_write'):
+                    store.add_jobs(jobs, daily_usage, gpu_usage, conn)
+            # Once the jobs are committed, the cached results missing them are dropped
+            invalidate_cached_usage(ssh.username, daily_usage)
+    task.advance()
+
+
+# This function builds the sacct command returning the jobs of a user (or every user) within the period [start, end].
+# The filters run on the cluster: the output has no header, and when states are given only the jobs that reached one
+# of these states during the period are returned, each followed by its step lines.
+def sacct_command(user, start, end, states=None):
+    user_filter = "--allusers" if user == ALL_USERS else f"--user={shlex.quote(user)}"
+    command = (f"sacct --noheader --parsable2 --format={','.join(SACCT_FIELDS)} {user_filter} "
+               f"--starttime={start:%Y-%m-%dT%H:%M:%S} --endtime={end:%Y-%m-%dT%H:%M:%S}")
+    if states:
+        command += f" --state={states}"
+    return command
+
+
+# This function executes the sacct command of a user (or every user) within the period [start, end].
+# The output is read from the channel in chunks and yielded as DataFrames of parsed jobs.
+# A failed command (e.g. slurmdbd unreachable) raises an error once its output is read, so that the period is not marked as synced.
+def stream_sacct(ssh, user, start, end, states=None):
+    command = sacct_command(user, start, end, states)
+    with span('ssh_exec', command='sacct'):
+        stdin, stdout, stderr = ssh.exec_command(command)
+    yield from read_sacct_batches(stdout)
+    check_exit_status('sacct', stdout, stderr)
+
+
+# This function sums the usage of the step lines of each job: the CPU time of all its steps, and the GPU utilization
+# averaged over the run time of the steps that measured it. The extern step, which only holds the allocation and runs
+# no task, is left out of the GPU utilization.
+def step_usage(steps):
+    parts = steps['JobID'].str.split('.', n=1)
+    utilization = parse_gpu_utilization(steps['TRESUsageInAve']).where(parts.str[1] != 'extern')
+    measured_seconds = steps['ElapsedRaw'].fillna(0).where(utilization.notna(), 0)
+    usage = pd.DataFrame({
+        'JobID': parts.str[0],
+        'TotalCPU': parse_durations(steps['TotalCPU']),
+        'UtilizationSeconds': (utilization * measured_seconds).fillna(0),
+        'MeasuredSeconds': measured_seconds,
+    }).groupby('JobID').sum()
+    usage['GPUUtil'] = usage['UtilizationSeconds'] / usage['MeasuredSeconds'].where(usage['MeasuredSeconds'] > 0)
+    return usage[['TotalCPU', 'GPUUtil']]
+
+
+# This function reads sacct output from a file-like object in fixed-size chunks and parses each chunk
+# into a DataFrame of jobs. The lines of the last job of a chunk, whose steps may be continued by the next chunk,
+# are carried over to it together with the line cut by the end of the chunk.
+def read_sacct_batches(stdout, chunk_size=READ_CHUNK_SIZE):
+    remainder = b''
+    while True:
+        with span('ssh_read', command='sacct'):
+            chunk = stdout.read(chunk_size)
+        if not chunk:
+            break
+        count('ssh_bytes', len(chunk), command='sacct')
+
+        data = remainder + chunk
+        cut = last_job_offset(data)
+        data, remainder = data[:cut], data[cut:]
+        if data.strip():
+            yield parse_timed(data)
+
+    if remainder.strip():
+        yield parse_timed(remainder)
 
-    return preprocess_data(result)
 
+# This function returns the offset of the allocation line (a JobID without '.') of the last job whose lines
+# are complete in data, or 0 if there is none. Only a few step lines per job are scanned backwards.
+def last_job_offset(data):
+    end = data.rfind(b'\n') + 1
+    while end > 0:
+        start = data.rfind(b'\n', 0, end - 1) + 1
+        if b'.' not in data[start:end].split(b'|', 1)[0]:
+            return start
+        end = start
+    return 0
 
-# This function processes the command output and converts it into a DataFrame
+
+# This function parses a batch of sacct lines and records the parse time and the number of jobs
+def parse_timed(data):
+    with span('parse'):
+        jobs = parse_sacct_lines(data)
+    count('rows', len(jobs), stage='parse')
+    return jobs
+
+
+# This function processes the command output and converts it into a DataFrame of day-split usage
 def preprocess_data(result):
-    df = pd.DataFrame()
+    return expand_jobs(parse_sacct_output(result))
+
+
+# This function parses the whole sacct output into a DataFrame with one row per job
+def parse_sacct_output(result):
+    return parse_sacct_lines(result.encode())
+
+
+# This function parses '|'-delimited sacct lines (without header) into a DataFrame with one row per job.
+# The usage of the step lines is added to their job: TotalCPU in seconds (0 for the jobs without steps) and GPUUtil
+# in percent (NaN for the jobs without GPUs and for the ones whose utilization was not measured).
+def parse_sacct_lines(data):
+    if data.strip():
+        lines = pd.read_csv(io.BytesIO(data), sep='|', header=None, names=SACCT_FIELDS, usecols=range(len(SACCT_FIELDS)),
+                            dtype=SACCT_DTYPES, na_values={field: [''] for field in SACCT_NUMERIC_FIELDS},
+                            keep_default_na=False, quoting=csv.QUOTE_NONE)
+    else:
+        lines = pd.DataFrame({field: pd.Series(dtype=dtype) for field, dtype in SACCT_DTYPES.items()})
 
-    # Process output
-    data = [line.split('|') for line in result.strip().split('\n')[1:]]
-    
-    columns = ['JobID', 'User', 'AllocCPUS', 'AllocGRES', 'Start', 'End']
-    df = pd.DataFrame(data, columns=columns)
+    is_step = lines['JobID'].str.contains('.', regex=False)
+    with span('step_usage'):
+        usage = step_usage(lines[is_step])
+    df = lines[~is_step].drop(columns=['TotalCPU', 'TRESUsageInAve'])
 
-    # Filter out batch entries
-    df = df[df['User'] != ""]
+    # Jobs that never ran (no run time, or Start = 'Unknown') are dropped before any date parsing
+    df = df[(df['ElapsedRaw'] > 0) & (df['Start'] != 'Unknown')].dropna(subset=['AllocCPUS'])
 
-    # Convert Start and End to datetime
-    df['Start'] = pd.to_datetime(df['Start'], errors='coerce')
-    df['End'] = pd.to_datetime(df['End'], errors='coerce')
-    
-    # Drop rows where either Start or End could not be converted
-    df = df.dropna(subset=['Start', 'End'])
+    # sacct prints ISO 8601 times; the explicit format keeps the parsing vectorized.
+    # End is derived from the run time instead of being parsed
+    df['Start'] = pd.to_datetime(df['Start'], format='ISO8601', errors='coerce')
+    df = df.dropna(subset=['Start'])
+    df['End'] = df['Start'] + pd.to_timedelta(df['ElapsedRaw'].astype(np.int64), unit='s')
 
     # Ensure data types are correct
-    df['AllocCPUS'] = pd.to_numeric(df['AllocCPUS'], errors='coerce')
-    df = df.dropna(subset=['AllocCPUS'])
+    df['AllocCPUS'] = df['AllocCPUS'].astype(np.int64)
 
-    # Apply the function to create a new column
-    df['NumGPUs'] = df['AllocGRES'].apply(extract_gpu_count)
+    # Memory, nodes, billing and GPUs of the allocation
+    df[TRES_COLUMNS] = parse_tres(df['AllocTRES'])
 
-    # Expanding each job
-    expanded_rows = [expand_job(row) for index, row in df.iterrows()]
-    df = pd.DataFrame([item for sublist in expanded_rows for item in sublist])
+    # Submission time, for the wait times of the job statistics
+    df['Submit'] = pd.to_datetime(df['Submit'], format='ISO8601', errors='coerce').fillna(df['Start'])
+
+    # Usage measured by the steps, for the job statistics
+    df['TotalCPU'] = df['JobID'].map(usage['TotalCPU']).fillna(0).astype(np.int64)
+    df['GPUUtil'] = df['JobID'].map(usage['GPUUtil']).where(df['NumGPUs'] > 0).astype(np.float64)
+
+    return df.drop(columns=['ElapsedRaw'])
+
+
+# This function converts a sacct duration, such as '1-02:03:04', '02:03:04' or '03:04.567', to seconds
+def parse_duration(text):
+    days, _, time_of_day = text.rpartition('-')
+    seconds = 0.0
+    for part in time_of_day.split(':'):
+        seconds = seconds * 60 + float(part or 0)
+    return seconds + int(days or 0) * 86400
+
+
+# This function converts a column of sacct durations to whole seconds. Like parse_tres, each distinct value is parsed once
+def parse_durations(values):
+    codes, uniques = pd.factorize(values)
+    seconds = np.array([parse_duration(value) for value in uniques], dtype=np.float64)
+    return pd.Series(np.round(seconds[codes]).astype(np.int64) if len(codes) else np.zeros(0, np.int64), index=values.index)
 
-    # Apply formatting to the ElapsedTime column
-    df['ElapsedTime'] = df['ElapsedTime'].apply(lambda x: format_timedelta(pd.to_timedelta(x)))
-    
-    # Convert ElapsedTime to timedelta
-    df['ElapsedTime_td'] = pd.to_timedelta(df['ElapsedTime'])
 
-    # Calculate CPUTime and GPUTime in timedelta
-    df['CPUTime_td'] = df['AllocCPUS'] * df['ElapsedTime_td']
-    df['GPUTime_td'] = df['NumGPUs'] * df['ElapsedTime_td']
+# This function extracts the GPU utilization (in percent) from a column of TRESUsageInAve strings; it is NaN where not measured
+def parse_gpu_utilization(values):
+    codes, uniques = pd.factorize(values)
+    utilization = pd.Series(uniques, dtype=str).str.extract(r'gres/gpuutil=([\d.]+)', expand=False).astype(np.float64)
+    return pd.Series(utilization.to_numpy()[codes], index=values.index)
 
-    df['CPUTime'] = df['CPUTime_td'].apply(timedelta_to_dd_hh_mm_ss)
-    df['GPUTime'] = df['GPUTime_td'].apply(timedelta_to_dd_hh_mm_ss)
 
-    # Drop temporary timedelta columns
-    df.drop(columns=['ElapsedTime_td', 'CPUTime_td', 'GPUTime_td'], inplace=True)
+# This function parses one TRES string, such as 'cpu=8,mem=32G,node=1,billing=8,gres/gpu=2,gres/gpu:a100=2'.
+# It returns the memory in megabytes, the number of nodes, the billing, the number of GPUs
+# and a dict with the number of GPUs of each model.
+def parse_tres_string(tres):
+    values = {}
+    for entry in tres.split(','):
+        name, _, value = entry.partition('=')
+        values[name] = value
+
+    memory = values.get('mem', '0') or '0'
+    if memory[-1] in MEMORY_UNITS:
+        memory_mb = int(float(memory[:-1]) * MEMORY_UNITS[memory[-1]])
+    else:
+        memory_mb = int(float(memory))
+
+    models = {name[len('gres/gpu:'):]: int(value) for name, value in values.items() if name.startswith('gres/gpu:')}
+    typed_gpus = sum(models.values())
+    num_gpus = int(values.get('gres/gpu', typed_gpus))
+    if num_gpus > typed_gpus:
+        models[UNTYPED_GPU_MODEL] = num_gpus - typed_gpus
+
+    return memory_mb, int(values.get('node', 0)), int(values.get('billing', 0)), num_gpus, models
+
+
+# This function parses a column of TRES strings into the TRES_COLUMNS. Allocations repeat a small number of
+# distinct TRES strings: each distinct string is parsed once and the results are spread to the rows with take(),
+# so the cost does not depend on the number of TRES types.
+def parse_tres(tres):
+    codes, uniques = pd.factorize(tres)
+    parsed = np.array([parse_tres_string(value)[:4] for value in uniques], dtype=np.int64).reshape(-1, len(TRES_COLUMNS))
+    return pd.DataFrame(parsed[codes], columns=TRES_COLUMNS, index=tres.index)
+
+
+# This function returns the number of GPUs of each model in a column of TRES strings, in long format:
+# Row (position of the row in the column), Model, NumGPUs. Rows without GPUs are left out.
+def gpu_models(tres):
+    codes, uniques = pd.factorize(tres)
+    models = pd.DataFrame(
+        [(code, model, gpus) for code, value in enumerate(uniques) for model, gpus in parse_tres_string(value)[4].items()],
+        columns=['Code', 'Model', 'NumGPUs'],
+    )
+    rows = pd.DataFrame({'Row': np.arange(len(codes)), 'Code': codes})
+    return rows.merge(models, on='Code').drop(columns='Code')
+
+
+# This function splits the jobs into days and calculates the usage of each day
+def expand_jobs(df):
+    # Expanding each job
+    df = split_jobs_by_day(df)
+
+    # Calculate CPU, GPU and memory (megabyte) seconds for each day. Times stay numeric; they are only formatted for display
+    df['CPUSeconds'] = df['AllocCPUS'] * df['ElapsedSeconds']
+    df['GPUSeconds'] = df['NumGPUs'] * df['ElapsedSeconds']
+    df['MemSeconds'] = df['MemMB'] * df['ElapsedSeconds']
 
     # Check if CSV file exists and append or create new file accordingly
     # We do not read from the csv file. Instead we directly use the generated dataframe. These lines are kept for debugging purposes.
@@ -114,7 +466,146 @@ def preprocess_data(result):
 
     return df
 
-# Function to expand the jobs into multiple rows for each day
+# This function rolls the day-split usage up to one row per (user, account, day): number of CPUs/GPUs and CPU/GPU/memory seconds.
+# Jobs of many users are rolled up in the same groupby.
+def rollup_daily_usage(df):
+    return df.groupby(['User', 'Account', 'Date'])[['AllocCPUS', 'NumGPUs', 'CPUSeconds', 'GPUSeconds', 'MemSeconds']].sum().reset_index()
+
+
+# This function rolls the day-split usage up to one row per (user, account, day, GPU model): number of GPUs and GPU seconds
+def rollup_gpu_usage(df):
+    models = gpu_models(df['AllocTRES'])
+    usage = df[['User', 'Account', 'Date']].iloc[models['Row']].reset_index(drop=True)
+    usage['Model'] = models['Model'].to_numpy()
+    usage['NumGPUs'] = models['NumGPUs'].to_numpy()
+    usage['GPUSeconds'] = usage['NumGPUs'] * df['ElapsedSeconds'].to_numpy()[models['Row']]
+    return usage.groupby(['User', 'Account', 'Date', 'Model'])[['NumGPUs', 'GPUSeconds']].sum().reset_index()
+
+
+# This function reads the jobs that ran during the period [start_date, end_date] from the local store of a login, without syncing it
+def load_jobs(login, user, start_date, end_date):
+    store = store_of(login)
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+    if user == ALL_USERS:
+        return store.load_cluster_jobs(start, end)
+    return store.load_jobs(user, start, end)
+
+
+# This function computes the efficiency and fairness statistics of the jobs of each user or account (by) in a single groupby:
+# the allocated and used CPU time and the CPU efficiency (used / allocated), the share of the GPU time during which the GPUs
+# were idle (over the jobs whose GPU utilization was measured), and the percentiles of the wait times (Submit -> Start)
+# and of the job durations, in seconds. Only the n users or accounts with the most allocated CPU time are kept.
+def job_statistics(jobs, by, n=TOP_N):
+    duration = (jobs['End'] - jobs['Start']).dt.total_seconds()
+    gpu_seconds = jobs['NumGPUs'] * duration
+    measured = jobs['GPUUtil'].notna() & (gpu_seconds > 0)
+    df = pd.DataFrame({
+        by: jobs[by],
+        'Wait': (jobs['Start'] - jobs['Submit']).dt.total_seconds().clip(lower=0),
+        'Duration': duration,
+        'CPUSeconds': jobs['AllocCPUS'] * duration,
+        'TotalCPU': jobs['TotalCPU'],
+        'MeasuredGPUSeconds': gpu_seconds.where(measured, 0),
+        'IdleGPUSeconds': (gpu_seconds * (1 - jobs['GPUUtil'] / 100)).where(measured, 0),
+    })
+
+    grouped = df.groupby(by)
+    stats = grouped[['CPUSeconds', 'TotalCPU', 'MeasuredGPUSeconds', 'IdleGPUSeconds']].sum()
+    stats['Jobs'] = grouped.size()
+    percentiles = grouped[['Wait', 'Duration']].quantile(PERCENTILES).unstack()
+    for column, q in percentiles.columns:
+        stats[f'{column}P{round(q * 100)}'] = percentiles[(column, q)]
+
+    stats['CPUEfficiency'] = stats['TotalCPU'] / stats['CPUSeconds'].where(stats['CPUSeconds'] > 0)
+    stats['GPUIdleShare'] = stats['IdleGPUSeconds'] / stats['MeasuredGPUSeconds'].where(stats['MeasuredGPUSeconds'] > 0)
+    return stats.nlargest(n, 'CPUSeconds').reset_index()
+
+
+# This function counts the jobs in each bin of DURATION_BIN_EDGES
+def duration_histogram(jobs):
+    duration = (jobs['End'] - jobs['Start']).dt.total_seconds().clip(upper=DURATION_BIN_EDGES[-1])
+    return np.histogram(duration, bins=DURATION_BIN_EDGES)[0]
+
+
+# This function returns the finest resolution (frequency and name) showing the period [start, end] in at most max_bars bars
+def choose_resolution(start, end, max_bars=MAX_BARS):
+    days = (end - start).days + 1
+    for freq, name, bin_days in RESOLUTIONS:
+        if days <= max_bars * bin_days or freq == RESOLUTIONS[-1][0]:
+            return freq, name
+
+
+# This function bins the daily usage of the period [start, end] (datetimes) by day, week, month or year,
+# so that the period is shown in at most max_bars bars. keys are the other columns the rows are grouped by (e.g. User, Account).
+# Times are summed over the days of each bin, and numbers of CPUs/GPUs are averaged over them.
+# It returns the binned usage, whose Date is the first day of each bin, and the name of the resolution.
+def bin_daily_usage(daily_usage, start, end, keys=(), max_bars=MAX_BARS):
+    freq, name = choose_resolution(start, end, max_bars)
+    usage = daily_usage[(daily_usage['Date'] >= start) & (daily_usage['Date'] <= end)]
+    if freq == 'D':
+        return usage.reset_index(drop=True), name
+
+    periods = usage['Date'].dt.to_period(freq)
+    binned = usage.drop(columns='Date').groupby([periods.rename('Date'), *keys]).sum().reset_index()
+
+    # Number of days of each bin within the period
+    first_day = binned['Date'].dt.start_time.clip(lower=start)
+    last_day = binned['Date'].dt.end_time.dt.normalize().clip(upper=end)
+    days = (last_day - first_day).dt.days + 1
+    binned[COUNT_COLUMNS] = binned[COUNT_COLUMNS].div(days, axis=0)
+
+    binned['Date'] = binned['Date'].dt.start_time
+    return binned, name
+
+
+# This function sums the cluster-wide daily usage per day and per user or account (by), for each of the columns.
+# For each column, the n users or accounts with the largest total keep their own rows and the others are summed into 'Others'.
+# The result is in long format: Date, <by>, Resource (column name), Usage.
+def breakdown_by(daily_usage, by, columns, n=TOP_N):
+    long = daily_usage.melt(id_vars=['Date', by], value_vars=columns, var_name='Resource', value_name='Usage')
+
+    totals = long.groupby(['Resource', by])['Usage'].sum()
+    ranks = totals.groupby(level='Resource').rank(method='first', ascending=False)
+    top = ranks[ranks <= n].index
+
+    is_top = pd.MultiIndex.from_frame(long[['Resource', by]]).isin(top)
+    long[by] = long[by].where(is_top, 'Others')
+    return long.groupby(['Date', by, 'Resource'])['Usage'].sum().reset_index()
+
+
+# Vectorized version of expand_job: splits every job into one row per calendar day it spans.
+# Day boundaries are computed with array arithmetic on whole columns and each job is repeated
+# once per day with np.repeat, so no Python-level loop runs per job or per job-day.
+# ElapsedSeconds is the number of seconds the job ran on that day (int64).
+def split_jobs_by_day(df):
+    start = df['Start'].to_numpy(dtype='datetime64[s]')
+    end = df['End'].to_numpy(dtype='datetime64[s]')
+    first_day = start.astype('datetime64[D]').astype('datetime64[s]')
+    one_day = np.timedelta64(1, 'D')
+
+    # Number of calendar days touched by each job. Jobs that never ran (End <= Start) produce no rows
+    seconds_from_first_day = (end - first_day).astype(np.int64)
+    num_days = np.where(end > start, -(-seconds_from_first_day // 86400), 0)
+
+    # Index of the source job and day offset of every output row
+    job_index = np.repeat(np.arange(len(df)), num_days)
+    day_offset = np.arange(len(job_index)) - np.repeat(np.cumsum(num_days) - num_days, num_days)
+
+    day_start = first_day[job_index] + day_offset * one_day
+    segment_start = np.maximum(start[job_index], day_start)
+    segment_end = np.minimum(day_start + one_day, end[job_index])
+
+    expanded = df.iloc[job_index][['JobID', 'User', 'Account', 'AllocCPUS', 'AllocTRES']].reset_index(drop=True)
+    expanded['Date'] = day_start.astype('datetime64[D]')
+    expanded['ElapsedSeconds'] = (segment_end - segment_start).astype(np.int64)
+    expanded['NumGPUs'] = df['NumGPUs'].to_numpy()[job_index]
+    expanded['MemMB'] = df['MemMB'].to_numpy()[job_index]
+    return expanded
+
+
+# Function to expand the jobs into multiple rows for each day.
+# Row-by-row reference implementation of split_jobs_by_day, kept to check the vectorized version against.
 def expand_job(row):
     start = row['Start']
     end = row['End']
@@ -130,7 +621,7 @@ def expand_job(row):
             'JobID': row['JobID'],
             'User': row['User'],
             'AllocCPUS': row['AllocCPUS'],
-            'AllocGRES': row['AllocGRES'],
+            'AllocTRES': row['AllocTRES'],
             'Date': current_date,
             'ElapsedTime': elapsed_time,
             'NumGPUs': row['NumGPUs']
@@ -140,18 +631,10 @@ def expand_job(row):
 
     return rows
 
-# Adjusting the format of the ElapsedTime column to HH:MM:SS
-def format_timedelta(td):
-    total_seconds = int(td.total_seconds())
-    hours, remainder = divmod(total_seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    return f"{hours:02}:{minutes:02}:{seconds:02}"
-
-
-# Convert timedeltas to DD-HH:MM:SS format
-def timedelta_to_dd_hh_mm_ss(td):
-    total_seconds = int(td.total_seconds())
+# Format a number of seconds as D-HH:MM:SS (used for display only)
+def format_dd_hh_mm_ss(total_seconds):
+    total_seconds = int(total_seconds)
     days, remainder = divmod(total_seconds, 86400)
     hours, remainder = divmod(remainder, 3600)
     minutes, seconds = divmod(remainder, 60)
-    return f"{days}-{hours:02}:{minutes:02}:{seconds:02}"
\ No newline at end of file
+    return f"{days}-{hours:02}:{minutes:02}:{seconds:02}"
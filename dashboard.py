@@ -0,0 +1,743 @@
+from flask import Flask, request, session, has_request_context, g
+import re
+import time
+import numpy as np
+import pandas as pd
+import dash
+from dash import dcc, html, Patch, no_update
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from collect_data import days_based_period, datetime_based_period, collect_daily_usage, cached_daily_usage, load_daily_usage, format_dd_hh_mm_ss, breakdown_by, bin_daily_usage, load_jobs, job_statistics, duration_histogram, ALL_USERS, GPU_MODEL_PREFIX, JOB_STATISTICS_GRAPHS, DURATION_BIN_LABELS
+from background_tasks import TaskRunner
+from live_status import live_poller_of, job_changes, LIVE_POLL_INTERVAL, LIVE_HISTORY
+from metrics import span, observe, count
+from sessions import SECRET_KEY, get_ssh, user_directory_of
+from shared_state import open_shared_cache
+import plotly.graph_objs as go
+from plotly.subplots import make_subplots
+from plotly.colors import qualitative
+from datetime import datetime, timedelta
+import dash_daq as daq
+import dash_bootstrap_components as dbc
+from dash_bootstrap_templates import load_figure_template
+from vendor_assets import DASHBOARD_STYLESHEETS, DASHBOARD_VENDOR_DIR, is_vendored
+
+# Load template
+load_figure_template("bootstrap_dark")
+
+# Colors of the users/accounts stacked in the cluster-wide graphs
+BAR_COLORS = qualitative.Plotly
+
+# Background data collections started by the dashboard callbacks. With a shared state directory, a collection started by
+# one worker process is polled and cancelled by whichever worker serves the next callback, instead of being started again.
+tasks = TaskRunner(shared=open_shared_cache('tasks'))
+
+# Flask server of the dashboard, loaded by app.py on the first dashboard request.
+# It reads the session cookie of the login pages, signed with the same key.
+server = Flask(__name__)
+server.secret_key = SECRET_KEY
+
+# Stylesheets and fonts are served locally once downloaded with `python vendor_assets.py`, from the CDNs otherwise
+external_stylesheets = [] if is_vendored(DASHBOARD_STYLESHEETS, DASHBOARD_VENDOR_DIR) else list(DASHBOARD_STYLESHEETS.values())
+
+# Initialize Dash app within its Flask server
+dash_app = dash.Dash(__name__, server=server, url_base_pathname='/dashboard/', external_stylesheets=external_stylesheets)
+
+# Time the Dash callback requests and count the bytes of the figures sent back to the browser
+@server.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@server.after_request
+def record_request(response):
+    if request.path.endswith('/_dash-update-component') and 'started' in g:
+        observe('dash_callback', time.perf_counter() - g.started)
+        if not response.direct_passthrough:
+            count('response_bytes', response.calculate_content_length() or 0, route='dash_callback')
+    return response
+
+# Function to get the users displayed in the dropdown menu: the first ones of the cached
+# user directory, or the ones matching the text typed in the dropdown
+def get_slurm_users(search_value=''):
+    ssh = get_ssh()
+    if ssh is None:
+        print("SSH connection not established.")
+        return []
+    return user_directory_of(ssh.username).search(ssh, search_value)
+
+# Function to build the options of the user dropdown, keeping the selected user listed
+def user_options(users, selected_user=None):
+    if selected_user and selected_user != ALL_USERS and selected_user not in users:
+        users = [selected_user] + users
+    return [{'label': 'All users', 'value': ALL_USERS}] + [{'label': user, 'value': user} for user in users]
+
+
+# Function to serve the layout, called each time the page is loaded
+def serve_layout():
+    ssh_username = session.get('username', '') if has_request_context() else ''
+    slurm_users = get_slurm_users()  # Fetch users from Slurm DB
+
+    # Logout Icon, from the Font Awesome stylesheet
+    icon = html.I(className="fas fa-sign-out-alt")
+
+    return html.Div([
+    # Sidebar
+    html.Div([
+        html.H2("Filters", style={'textAlign': 'center', 'color': '#FFF'}),
+            # User selection dropdown
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id='user-dropdown',
+                        options=user_options(slurm_users),
+                        value=None
+                    )
+                ],
+                style={'margin-bottom': '20px', 'margin-top': '20px'}
+            ),
+            # Breakdown of the cluster-wide view, only shown when all users are selected
+            html.Div(
+                [dcc.RadioItems(
+                    id='breakdown-type',
+                    options=[
+                        {'label': 'By user', 'value': 'User'},
+                        {'label': 'By account', 'value': 'Account'}
+                    ],
+                    value='User',
+                    inline=True,
+                    inputStyle={'marginRight': '5px', 'marginLeft': '10px'},
+                    style={'color': '#FFF', 'textAlign': 'center'}
+                )],
+                id='breakdown-container',
+                style={'display': 'none'}
+            ),
+            html.Div([
+                html.Label('Customize the timeframe\t', style={'color': '#FFF'}),
+                daq.BooleanSwitch(
+                    id='date-selection-toggle',
+                    on=True,  # Initially on
+                    labelPosition="top",
+                    color="#EF213B",
+                ),
+            ], style={'display': 'flex', 'alignItems': 'center', 'justifyContent': 'center', 'margin': '10px', 'margin-bottom': '10px'}),
+            
+            # Date Picker Range
+            html.Div([
+                dcc.DatePickerRange(
+                    id='date-picker-range',
+                    min_date_allowed=datetime(1995, 8, 5), 
+                    max_date_allowed=datetime.now(),
+                    initial_visible_month=datetime.now(),
+                    start_date=datetime.now() - timedelta(days=30),  # Default to 30 days ago
+                    end_date=datetime.now(),
+                    style={
+                        'display': 'block',  # Initially visible
+                        'width': '100%',  
+                        'fontFamily': 'Fantasy, sans-serif',  
+                        'border': '1px solid #ccc',  
+                        'borderRadius': '5px',  
+                        'padding': '10px',  
+                        'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'  
+                    }
+                )
+                ],
+                style={
+                    'display': 'flex',  
+                    'flexDirection': 'column',  
+                    'alignItems': 'center', 
+                    # 'margin-bottom': '20px',
+                }
+            ),
+
+            # Timeframe selection
+            html.Div(
+                [dcc.Dropdown(
+                    id='timeframe-dropdown',
+                    options=[
+                        {'label': '1 Month Ago', 'value': 30},
+                        {'label': '2 Months Ago', 'value': 60},
+                        {'label': '3 Months Ago', 'value': 90},
+                        {'label': '4 Months Ago', 'value': 120},
+                        {'label': '5 Months Ago', 'value': 150},
+                        {'label': '6 Months Ago', 'value': 180},
+                        {'label': '7 Months Ago', 'value': 210},
+                        {'label': '8 Months Ago', 'value': 240},
+                        {'label': '9 Months Ago', 'value': 270},
+                        {'label': '10 Months Ago', 'value': 300},
+                        {'label': '11 Months Ago', 'value': 330},
+                        {'label': '1 Year Ago', 'value': 365}
+                    ],
+                    value=30  # Default value set to 1 month ago
+                )
+                ],
+                style={
+                    'margin-bottom': '20px',
+                    }
+            ),
+
+            # Toggle between CPU usage and Hours usage
+            html.Div(
+                [dcc.RadioItems(
+                    id='graph-type',
+                    options=[
+                        {'label': 'Number of CPUs/GPUs', 'value': 'cpu_gpu'},
+                        {'label': 'Hours Usage', 'value': 'hours'},
+                        {'label': 'GPU Hours per GPU Model', 'value': 'gpu_models'},
+                        {'label': 'Memory Hours', 'value': 'memory'},
+                        {'label': 'CPU Efficiency and GPU Idle Share', 'value': 'efficiency'},
+                        {'label': 'Wait Time Percentiles', 'value': 'wait_time'},
+                        {'label': 'Job Duration Percentiles', 'value': 'durations'}
+                    ],
+                    value='cpu_gpu',
+                    labelStyle={'display': 'block', 'margin': '10px 0'},  
+                    inputStyle={'marginRight': '5px'},  
+                    style={
+                        'display': 'flex',  
+                        'flexDirection': 'column',  
+                        'fontFamily': 'Arial, sans-serif',  
+                        'padding': '10px',  
+                        'border': '1px solid #ccc',  
+                        'margin': '20px',
+                        'borderRadius': '10px', 
+                        'backgroundColor': '#000', 
+                        'color': '#FFF', 
+                    }
+                )
+                ],
+                style={}
+            ),
+            # Logout button
+            html.Div([
+                icon,
+                html.A("Logout", href="/logout", style={
+                    'color': 'white',
+                    'display': 'flex', 
+                    'alignItems': 'center', 
+                    'justifyContent': 'center',
+                    "text-decoration": "none",
+                    'margin-left': '5px'})
+            ], style={
+                    "position": "absolute",
+                    "bottom": "50px",
+                    "left": "50%",
+                    'margin-left': '-75px',
+                    'display': 'flex', 
+                    'alignItems': 'center', 
+                    'justifyContent': 'center', 
+                    'justifyContent': 'center',
+                    'color': 'white',
+                    'border': '1px solid #ccc',
+                    'padding': '10px',
+                    'width': '150px'})
+    ], style={
+        "position": 'relative',
+        'display': 'flex',  
+        'flexDirection': 'column',  
+        'justifyContent': 'center', 
+        'height': '100vh',  
+        'width': '20%',  
+        'fontFamily': "'Rubik', sans-serif", 
+        'float': 'left', 
+        'borderRight': '2px solid #04090E', 
+        'padding': '0 10px 20px', 
+        'background-color': '#04090E', 
+        'box-sizing': 'border-box'}),
+    
+    # Main content area
+    html.Div([
+        html.Div([dbc.Button(
+                [
+                    f"Hello, {ssh_username}",
+                ],
+                color="dark",
+                style={
+                    "cursor": "context-menu",   
+                    'font-size': '18px'
+                    }
+            )],
+            style={"position": "relative"}
+        ), 
+        html.H2("Visualize the results", style={'textAlign': 'center', 'color': '#000', 'font-weight': 'bold'}),
+        dcc.Tabs(id='view-tabs', value='history', children=[
+            dcc.Tab(label='Usage history', value='history', children=[
+                dcc.Graph(id='usage-graph'),
+            ]),
+            dcc.Tab(label='Live cluster', value='live', children=[
+                html.P("Polling the cluster...", id='live-summary', style={'textAlign': 'center', 'margin-top': '10px'}),
+                dcc.Graph(id='live-timeline'),
+                html.Div([
+                    dcc.Graph(id='live-users', style={'width': '50%'}),
+                    dcc.Graph(id='live-nodes', style={'width': '50%'}),
+                ], style={'display': 'flex'}),
+            ]),
+        ]),
+        # Background task of the current selection and the interval polling it
+        dcc.Store(id='graph-task'),
+        dcc.Interval(id='graph-poll', interval=1000, disabled=True),
+        # Version of the live snapshot shown, with the order of the users and nodes of its bars, and the interval polling it
+        dcc.Store(id='live-state'),
+        dcc.Interval(id='live-poll', interval=LIVE_POLL_INTERVAL * 1000, disabled=True)
+    ], style={
+        'display': 'flex',
+        'flexDirection': 'column',
+        'justifyContent': 'center',
+        'width': '80%',
+        'float': 'right', 
+        'height': '100vh', 
+        'padding': '40px', 
+        'background-color': "#FFF", 
+        'fontFamily': "'Rubik', sans-serif"})
+])
+
+# Set the layout to the serve_layout function
+dash_app.layout = serve_layout
+
+@dash_app.callback(
+    [Output('date-picker-range', 'style'),
+     Output('timeframe-dropdown', 'style')],
+    [Input('date-selection-toggle', 'on')]
+)
+def toggle_date_input(toggle_value):
+    if toggle_value:
+        return {'display': 'block'}, {'display': 'none'}
+    else:
+        return {'display': 'none'}, {'display': 'block'}
+
+
+# Callback to search the user directory on the server as the user types in the dropdown
+@dash_app.callback(
+    Output('user-dropdown', 'options'),
+    [Input('user-dropdown', 'search_value')],
+    [State('user-dropdown', 'value')]
+)
+def update_user_options(search_value, selected_user):
+    if not search_value:
+        raise PreventUpdate
+    return user_options(get_slurm_users(search_value), selected_user)
+
+
+@dash_app.callback(
+    Output('breakdown-container', 'style'),
+    [Input('user-dropdown', 'value')]
+)
+def toggle_breakdown(selected_user):
+    if selected_user == ALL_USERS:
+        return {'display': 'block', 'margin-bottom': '10px'}
+    else:
+        return {'display': 'none'}
+
+
+# Function to create a bar trace from numeric columns. The values are sent to the browser as binary typed arrays
+# and the dates as days, which keeps the figure small.
+def usage_bar(name, dates, values, **kwargs):
+    return go.Bar(name=name, x=dates.to_numpy(dtype='datetime64[D]'), y=values.to_numpy(dtype=np.float64), **kwargs)
+
+
+# Function to create the cluster-wide figure: for each resource, the usage stacked by user or account
+def create_breakdown_figure(dataframe, selected_graph, breakdown, resolution):
+    if selected_graph == 'cpu_gpu':
+        df = dataframe.rename(columns={'AllocCPUS': 'CPU', 'NumGPUs': 'GPU'})
+        resources = ['CPU', 'GPU']
+        title = count_title(f'Number of CPUs/GPUs Used by {breakdown}', resolution)
+        unit = 'Usage'
+    elif selected_graph == 'memory':
+        df = dataframe[['Date', 'User', 'Account']].copy()
+        df['Memory'] = dataframe['MemSeconds'] / (3600 * 1024)
+        resources = ['Memory']
+        title = f'{resolution} Memory Usage by {breakdown}'
+        unit = 'Usage (GB-hours)'
+    else:
+        df = dataframe[['Date', 'User', 'Account']].copy()
+        df['CPU'] = dataframe['CPUSeconds'] / 3600
+        df['GPU'] = dataframe['GPUSeconds'] / 3600
+        resources = ['CPU', 'GPU']
+        title = f'{resolution} CPU and GPU Hours Usage by {breakdown}'
+        unit = 'Usage (hours)'
+
+    # Top users/accounts of each resource, the others summed together
+    long = breakdown_by(df, breakdown, resources)
+
+    # One row of bars per resource. A user or account has the same color in every row and a single legend entry
+    names = long[breakdown].unique().tolist()
+    colors = {name: BAR_COLORS[i % len(BAR_COLORS)] for i, name in enumerate(names)}
+    fig = make_subplots(rows=len(resources), cols=1, shared_xaxes=True, subplot_titles=resources, vertical_spacing=0.08)
+    for row, resource in enumerate(resources, start=1):
+        usage = long[long['Resource'] == resource]
+        for name, group in usage.groupby(breakdown, sort=False):
+            fig.add_trace(usage_bar(name, group['Date'], group['Usage'], legendgroup=name, showlegend=row == 1,
+                                    marker_color=colors[name]), row=row, col=1)
+        fig.update_yaxes(title_text=unit, row=row, col=1)
+
+    fig.update_layout(title=title, barmode='relative', legend_title_text=breakdown)
+    fig.update_xaxes(title_text='Date', row=len(resources), col=1)
+    return fig
+
+
+# Function to create the figure of the GPU hours stacked by GPU model.
+# In the cluster-wide view, the GPU hours of all users are summed.
+def create_gpu_model_figure(dataframe, resolution):
+    columns = [column for column in dataframe.columns if column.startswith(GPU_MODEL_PREFIX)]
+    if not columns:
+        return message_figure("No GPU usage during this period of time.")
+
+    df = dataframe.groupby('Date')[columns].sum().reset_index()
+    fig = go.Figure([usage_bar(column[len(GPU_MODEL_PREFIX):], df['Date'], df[column] / 3600) for column in columns])
+    fig.update_layout(title=f'{resolution} GPU Hours per GPU Model', xaxis_title='Date', yaxis_title='Usage (hours)',
+                      barmode='relative', legend_title_text='GPU model')
+    return fig
+
+
+# Function to create the figures of the job statistics of the period: CPU efficiency and GPU idle share,
+# wait time percentiles, or job duration percentiles with the histogram of the job durations.
+# The cluster-wide view compares users or accounts, and the view of a user compares its accounts.
+def create_statistics_figure(jobs, selected_user, selected_graph, breakdown):
+    if jobs.empty:
+        return message_figure("No jobs during this period of time.")
+
+    by = breakdown if selected_user == ALL_USERS else 'Account'
+    stats = job_statistics(jobs, by)
+    names = stats[by].tolist()
+    customdata = stats['Jobs'].to_numpy()
+
+    if selected_graph == 'efficiency':
+        fig = go.Figure([
+            go.Bar(name=name, x=names, y=stats[column].to_numpy() * 100, customdata=customdata,
+                   hovertemplate='%{x}<br>%{y:.1f}%<br>%{customdata} jobs<extra>' + name + '</extra>')
+            for name, column in [('CPU efficiency', 'CPUEfficiency'), ('GPU idle share', 'GPUIdleShare')]
+        ])
+        fig.update_layout(title=f'CPU Efficiency (Used / Allocated CPU Time) and GPU Idle Share by {by}',
+                          xaxis_title=by, yaxis_title='%', barmode='group', legend_title_text='Metric')
+        if stats['GPUIdleShare'].isna().all():
+            fig.update_layout(title=f"{fig.layout.title.text} - GPU utilization not measured")
+        return fig
+
+    column = 'Wait' if selected_graph == 'wait_time' else 'Duration'
+    bars = [
+        go.Bar(name=f'p{percentile}', x=names, y=stats[f'{column}P{percentile}'].to_numpy() / 3600, customdata=customdata,
+               hovertemplate='%{x}<br>%{y:.2f} hours<br>%{customdata} jobs<extra>p' + str(percentile) + '</extra>')
+        for percentile in [50, 95]
+    ]
+    if selected_graph == 'wait_time':
+        fig = go.Figure(bars)
+        fig.update_layout(title=f'Wait Time (Submit to Start) Percentiles by {by}', xaxis_title=by, yaxis_title='Wait (hours)',
+                          barmode='group', legend_title_text='Percentile')
+        return fig
+
+    fig = make_subplots(rows=2, cols=1, subplot_titles=[f'Job Duration Percentiles by {by}', 'Number of Jobs per Duration'],
+                        vertical_spacing=0.15)
+    for bar in bars:
+        fig.add_trace(bar, row=1, col=1)
+    fig.add_trace(go.Bar(name='Jobs', x=DURATION_BIN_LABELS, y=duration_histogram(jobs), showlegend=False), row=2, col=1)
+    fig.update_yaxes(title_text='Duration (hours)', row=1, col=1)
+    fig.update_yaxes(title_text='Jobs', row=2, col=1)
+    fig.update_layout(title='Job Durations', barmode='group', legend_title_text='Percentile')
+    return fig
+
+
+# Function to get the title of a graph of numbers of resources: when the bars are longer than a day, they show daily averages
+def count_title(title, resolution):
+    if resolution == 'Daily':
+        return f'Daily {title}'
+    return f'{resolution} {title} (daily average)'
+
+
+# Function to get the (start_date, end_date) period selected in the sidebar, or None if it is incomplete
+def selected_period(toggle_switch_state, selected_timeframe, start_date, end_date):
+    if toggle_switch_state:
+        # Custom date range selected
+        if start_date and end_date:
+            return datetime_based_period(start_date, end_date)
+    else:
+        # Predefined timeframe selected
+        if selected_timeframe is not None:
+            return days_based_period(selected_timeframe)
+    return None
+
+
+# Function to create a figure with only a title, used for messages
+def message_figure(message):
+    return go.Figure(
+        data=[go.Scatter(x=[], y=[])],
+        layout=go.Layout(
+            title=message,
+            xaxis=dict(showgrid=False, showticklabels=False, zeroline=False),
+            yaxis=dict(showgrid=False, showticklabels=False, zeroline=False)
+        )
+    )
+
+
+# Function to create the usage figure from the per-day usage of the period (start_date, end_date).
+# The days are binned by week, month or year when the period is too long to show each of them;
+# view is the (start, end) range the graph is zoomed to, whose days are binned on their own.
+# The job statistics graphs are computed from the jobs of the period in the local store of the login instead of their daily usage.
+def create_figure(dataframe, selected_user, selected_graph, selected_breakdown, period, login, view=None):
+    if dataframe.empty:
+        # Return a figure with a message if the dataframe is empty
+        return message_figure("No data available for this user during this period of time.")
+
+    if selected_graph in JOB_STATISTICS_GRAPHS:
+        # Statistics of the individual jobs, read from the local store that the daily usage was synced from
+        with span('job_statistics', graph=selected_graph):
+            jobs = load_jobs(login, selected_user, *period)
+        return create_statistics_figure(jobs, selected_user, selected_graph, selected_breakdown)
+
+    start, end = view or [datetime.strptime(date, "%Y-%m-%d") for date in period]
+    keys = ['User', 'Account'] if selected_user == ALL_USERS else []
+    dataframe, resolution = bin_daily_usage(dataframe, start, end, keys)
+
+    if selected_graph == 'gpu_models':
+        fig = create_gpu_model_figure(dataframe, resolution)
+
+    # Cluster-wide view: the usage of all users, fetched in a single query, stacked by user or account
+    elif selected_user == ALL_USERS:
+        fig = create_breakdown_figure(dataframe, selected_graph, selected_breakdown, resolution)
+
+    # Depending on the selected graph type, create and return the appropriate figure
+    elif selected_graph == 'cpu_gpu':
+        # CPU/GPU usage bar chart from the per-day sums
+        fig = go.Figure([
+            usage_bar('CPU', dataframe['Date'], dataframe['AllocCPUS']),
+            usage_bar('GPU', dataframe['Date'], dataframe['NumGPUs']),
+        ])
+        fig.update_layout(title=count_title('Number of CPUs/GPUs Used', resolution), xaxis_title='Date', yaxis_title='Usage',
+                          barmode='relative', legend_title_text='Resource')
+
+    elif selected_graph == 'memory':
+        # Memory allocated to the jobs, in gigabyte-hours
+        fig = go.Figure([usage_bar('Memory', dataframe['Date'], dataframe['MemSeconds'] / (3600 * 1024))])
+        fig.update_layout(title=f'{resolution} Memory Usage', xaxis_title='Date', yaxis_title='Usage (GB-hours)')
+
+    else:
+        # Hours usage graph: the CPU and GPU seconds converted to hours, with the exact D-HH:MM:SS totals on hover
+        fig = go.Figure([
+            usage_bar(resource, dataframe['Date'], dataframe[f'{resource}Seconds'] / 3600,
+                      customdata=dataframe[f'{resource}Seconds'].map(format_dd_hh_mm_ss).to_numpy(dtype=object),
+                      hovertemplate='Date=%{x}<br>Usage (hours)=%{y:.2f}<br>Time=%{customdata}<extra>' + resource + '</extra>')
+            for resource in ['CPU', 'GPU']
+        ])
+        fig.update_layout(title=f'{resolution} CPU and GPU Hours Usage', xaxis_title='Date', yaxis_title='Usage (hours)',
+                          barmode='relative', legend_title_text='Resource')
+
+    if view:
+        fig.update_xaxes(range=[view[0], view[1] + timedelta(days=1)])
+    return fig
+
+
+# Function to get the date range the graph was zoomed to from its relayout event, as (start day, end day), or None
+def zoomed_range(relayout_data):
+    for key, value in (relayout_data or {}).items():
+        if re.fullmatch(r'xaxis\d*\.range\[0\]', key):
+            start, end = value, relayout_data[key[:-3] + '[1]']
+        elif re.fullmatch(r'xaxis\d*\.range', key):
+            start, end = value
+        else:
+            continue
+        return pd.Timestamp(start).normalize().to_pydatetime(), pd.Timestamp(end).normalize().to_pydatetime()
+    return None
+
+
+# Function to create the figure shown while the data is being collected: the usage of the jobs saved so far
+def progress_figure(task, login, selected_user, period, selected_graph, selected_breakdown):
+    progress = f"Loading data... ({task.done_steps}/{task.total_steps} queries done)" if task.total_steps else "Loading data..."
+    dataframe = load_daily_usage(login, selected_user, *period)
+    if dataframe.empty:
+        return message_figure(progress)
+
+    fig = create_figure(dataframe, selected_user, selected_graph, selected_breakdown, period, login)
+    fig.update_layout(title=f"{fig.layout.title.text} - {progress}")
+    return fig
+
+
+# Callback to update the graph based on user and timeframe selection.
+# Data that is not cached is collected by a background task, so that the request returns immediately;
+# the 'graph-poll' interval then refreshes the graph with the partial results until the task is done.
+# Selecting another user or period cancels the task of the previous selection.
+# Zooming the graph re-bins the days of the zoomed range, and resetting the zoom shows the whole period again.
+@dash_app.callback(
+    [Output('usage-graph', 'figure'),
+     Output('graph-task', 'data'),
+     Output('graph-poll', 'disabled')],
+    [Input('user-dropdown', 'value'), 
+     Input('graph-type', 'value'), 
+     Input('timeframe-dropdown', 'value'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('date-selection-toggle', 'on'),  # Add toggle switch's state as input
+     Input('breakdown-type', 'value'),
+     Input('graph-poll', 'n_intervals'),
+     Input('usage-graph', 'relayoutData')],
+    [State('graph-task', 'data')]
+)
+def update_graph(selected_user, selected_graph, selected_timeframe, start_date, end_date, toggle_switch_state, selected_breakdown, n_intervals, relayout_data, running):
+    # Only zooms and zoom resets change the bins; other relayout events (resizing, panning the legend...) do not
+    zoomed = dash.callback_context.triggered_id == 'usage-graph'
+    view = zoomed_range(relayout_data) if zoomed else None
+    if zoomed and view is None and not any(key.endswith('autorange') for key in (relayout_data or {})):
+        raise PreventUpdate
+    # The job statistics are not shown by date
+    if zoomed and selected_graph in JOB_STATISTICS_GRAPHS:
+        raise PreventUpdate
+
+    ssh = get_ssh()
+    owner = session.get('ssh_session')
+    period = selected_period(toggle_switch_state, selected_timeframe, start_date, end_date)
+    key = [selected_user, *period] if selected_user and period else None
+
+    # The task collecting the data of the previous selection, if any
+    task = tasks.get(running['id'], owner) if running else None
+    if task and running['key'] != key:
+        task.cancel()
+        task = None
+
+    if not selected_user or not ssh:
+        return go.Figure(), None, True  # Return an empty figure if no user is selected or if SSH connection fails
+    if period is None:
+        return create_figure(pd.DataFrame(), selected_user, selected_graph, selected_breakdown, period, ssh.username), None, True
+
+    if task is None:
+        # The graph being zoomed was built from data already in the local store
+        dataframe = cached_daily_usage(ssh.username, selected_user, *period)
+        if dataframe is None and zoomed:
+            dataframe = load_daily_usage(ssh.username, selected_user, *period)
+        if dataframe is not None:
+            count('graph_updates', result='zoomed' if zoomed else 'cached')
+            with span('figure', graph=selected_graph):
+                figure = create_figure(dataframe, selected_user, selected_graph, selected_breakdown, period, ssh.username, view)
+            return figure, None, True
+
+        count('graph_updates', result='submitted')
+        task = tasks.submit(owner, collect_daily_usage, ssh, selected_user, *period)
+
+    if not task.done():
+        return progress_figure(task, ssh.username, selected_user, period, selected_graph, selected_breakdown), {'id': task.id, 'key': key}, False
+
+    try:
+        dataframe = task.result()
+    except Exception as e:
+        print(f"Error collecting data: {e}")
+        count('graph_updates', result='failed')
+        return message_figure("Could not collect the data from the cluster."), None, True
+    # The collections of the other worker processes leave their result in the cache and the local store
+    if dataframe is None:
+        dataframe = cached_daily_usage(ssh.username, selected_user, *period)
+        if dataframe is None:
+            dataframe = load_daily_usage(ssh.username, selected_user, *period)
+    count('graph_updates', result='collected')
+    with span('figure', graph=selected_graph):
+        figure = create_figure(dataframe, selected_user, selected_graph, selected_breakdown, period, ssh.username)
+    return figure, None, True
+
+
+@dash_app.callback(
+    Output('live-poll', 'disabled'),
+    [Input('view-tabs', 'value')]
+)
+def toggle_live_poll(selected_tab):
+    return selected_tab != 'live'
+
+
+# Function to create the bar figure of the (CPUs, GPUs) allocated to each user or node.
+# The values are sent as lists, not typed arrays, so that the following polls can patch single bars.
+def live_bar_figure(title, names, allocations):
+    fig = go.Figure([
+        go.Bar(name=resource, x=list(names), y=[allocations[name][i] for name in names])
+        for i, resource in enumerate(['CPU', 'GPU'])
+    ])
+    fig.update_layout(title=title, yaxis_title='Allocated', barmode='group', legend_title_text='Resource')
+    return fig
+
+
+# Function to create the timeline of the CPUs and GPUs allocated on the cluster at each poll
+def live_timeline_figure(timeline):
+    times = [polled_time.strftime('%Y-%m-%d %H:%M:%S') for version, polled_time, allocated in timeline]
+    totals = [allocated for version, polled_time, allocated in timeline]
+    fig = go.Figure([
+        go.Scatter(name=resource, x=times, y=[allocated[i] for allocated in totals], mode='lines')
+        for i, resource in enumerate(['CPU', 'GPU'])
+    ])
+    fig.update_layout(title='Allocated CPUs and GPUs', xaxis_title='Time', yaxis_title='Allocated', legend_title_text='Resource')
+    return fig
+
+
+# Function to patch a figure of live_bar_figure from the previous allocations to the latest ones: only the bars that changed
+# are sent, and the users or nodes that appeared are added at the end. names is updated with them.
+def patch_live_bars(names, previous, latest):
+    patch = Patch()
+    changed = False
+    for i, name in enumerate(names):
+        for trace, (old, new) in enumerate(zip(previous.get(name, (0, 0)), latest.get(name, (0, 0)))):
+            if old != new:
+                patch['data'][trace]['y'][i] = new
+                changed = True
+
+    shown = set(names)
+    for name, values in latest.items():
+        if name not in shown:
+            names.append(name)
+            for trace, value in enumerate(values):
+                patch['data'][trace]['x'].append(name)
+                patch['data'][trace]['y'].append(value)
+            changed = True
+    return patch if changed else no_update
+
+
+# Function to describe the latest snapshot, with the jobs that started and ended since the previous one shown
+def live_summary(latest, previous):
+    (cpus, gpus), (total_cpus, total_gpus) = latest.totals()
+    summary = (f"{len(latest.jobs)} running jobs, {cpus}/{total_cpus} CPUs and {gpus}/{total_gpus} GPUs allocated "
+               f"at {latest.time.strftime('%H:%M:%S')}")
+    if previous is not None:
+        started, ended = job_changes(previous, latest)
+        summary += f" - {len(started)} jobs started and {len(ended)} ended since the previous update"
+    return summary
+
+
+# Callback to refresh the live view of the cluster. The poller runs squeue/sinfo at most once per LIVE_POLL_INTERVAL
+# for all the open dashboards. A browser that already shows a recent snapshot is only sent the changes: the bars of the users
+# and nodes whose allocation changed, through a Patch, and the new points of the timeline, through extendData.
+# The figures are rebuilt when the tab is opened, since its graphs are remounted, or when the shown snapshot is no longer kept.
+@dash_app.callback(
+    [Output('live-users', 'figure'),
+     Output('live-nodes', 'figure'),
+     Output('live-timeline', 'figure'),
+     Output('live-timeline', 'extendData'),
+     Output('live-summary', 'children'),
+     Output('live-state', 'data')],
+    [Input('live-poll', 'n_intervals'),
+     Input('view-tabs', 'value')],
+    [State('live-state', 'data')]
+)
+def update_live_view(n_intervals, selected_tab, state):
+    ssh = get_ssh()
+    if selected_tab != 'live' or ssh is None:
+        raise PreventUpdate
+    live_poller = live_poller_of(ssh.username)
+    latest = live_poller.latest(ssh)
+    if latest is None:
+        raise PreventUpdate
+
+    polled = dash.callback_context.triggered_id == 'live-poll'
+    previous = live_poller.get(state['version']) if polled and state else None
+    if previous is not None and previous.version == latest.version:
+        raise PreventUpdate
+
+    if previous is None:
+        count('live_updates', result='full')
+        users, nodes = sorted(latest.users), sorted(latest.nodes)
+        return (live_bar_figure('Allocated CPUs and GPUs per User', users, latest.users),
+                live_bar_figure('Allocated CPUs and GPUs per Node', nodes, latest.nodes),
+                live_timeline_figure(live_poller.timeline()), no_update,
+                live_summary(latest, None), {'version': latest.version, 'users': users, 'nodes': nodes})
+
+    count('live_updates', result='patch')
+    users, nodes = list(state['users']), list(state['nodes'])
+    timeline = live_poller.timeline()
+    versions = [version for version, polled_time, allocated in timeline]
+    new_points = timeline[versions.index(previous.version) + 1:] if previous.version in versions else timeline[-1:]
+    times = [polled_time.strftime('%Y-%m-%d %H:%M:%S') for version, polled_time, allocated in new_points]
+    totals = [allocated for version, polled_time, allocated in new_points]
+    points = dict(x=[times, times], y=[[cpus for cpus, gpus in totals], [gpus for cpus, gpus in totals]])
+    return (patch_live_bars(users, previous.users, latest.users),
+            patch_live_bars(nodes, previous.nodes, latest.nodes),
+            no_update, (points, [0, 1], LIVE_HISTORY),
+            live_summary(latest, previous), {'version': latest.version, 'users': users, 'nodes': nodes})
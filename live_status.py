@@ -0,0 +1,218 @@
+from datetime import datetime
+import os
+import re
+import shlex
+import threading
+import time
+import uuid
+from collect_data import parse_tres_string
+from metrics import span, count
+from ssh_connection import check_exit_status
+from shared_state import open_shared_cache
+
+# Seconds between two polls of squeue and sinfo, whatever the number of dashboards open
+LIVE_POLL_INTERVAL = 15
+
+# Number of polls kept: the browsers are sent the changes since the last poll they have seen, and the timeline shows them
+LIVE_HISTORY = 240
+
+# Running jobs, one per line: JobID|User|Account|AllocTRES|NodeList. Every field is padded to its size and followed by '|'.
+# The formats are quoted, as the remote shell would take '|' for a pipe.
+SQUEUE_COMMAND = "squeue --noheader --states=RUNNING --Format=" + shlex.quote("JobID:64|,UserName:64|,Account:64|,tres-alloc:512|,NodeList:4096|")
+
+# Nodes, one per line and partition: NodeName|CPUs allocated/idle/other/total|Gres
+SINFO_COMMAND = "sinfo --Node --noheader --format=" + shlex.quote("%N|%C|%G")
+
+
+# Function to expand a Slurm hostlist, e.g. 'node[01-03,07],gpu1' into ['node01', 'node02', 'node03', 'node07', 'gpu1']
+def expand_hostlist(hostlist):
+    hosts = []
+    for item in re.findall(r'[^,\[]+(?:\[[^\]]*\][^,\[]*)*', hostlist):
+        match = re.search(r'\[([^\]]*)\]', item)
+        if match is None:
+            hosts.append(item)
+            continue
+        prefix, suffix = item[:match.start()], item[match.end():]
+        for part in match.group(1).split(','):
+            first, _, last = part.partition('-')
+            for number in range(int(first), int(last or first) + 1):
+                hosts += expand_hostlist(f"{prefix}{number:0{len(first)}d}{suffix}")
+    return hosts
+
+
+# Function to get the running jobs: {JobID: (user, account, CPUs, GPUs, nodes)}
+def fetch_running_jobs(ssh):
+    with span('ssh_exec', command='squeue'):
+        stdin, stdout, stderr = ssh.exec_command(SQUEUE_COMMAND)
+    with span('ssh_read', command='squeue'):
+        result = stdout.read()
+    count('ssh_bytes', len(result), command='squeue')
+    check_exit_status('squeue', stdout, stderr)
+
+    jobs = {}
+    for line in result.decode().splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) < 5 or not fields[0]:
+            continue
+        job_id, user, account, tres, nodes = fields[:5]
+        cpus = re.search(r'(?:^|,)cpu=(\d+)', tres)
+        jobs[job_id] = (user, account, int(cpus.group(1)) if cpus else 0, parse_tres_string(tres)[3], expand_hostlist(nodes))
+    return jobs
+
+
+# Function to get the CPUs of each node: {node: (allocated CPUs, total CPUs, total GPUs)}
+def fetch_nodes(ssh):
+    with span('ssh_exec', command='sinfo'):
+        stdin, stdout, stderr = ssh.exec_command(SINFO_COMMAND)
+    with span('ssh_read', command='sinfo'):
+        result = stdout.read()
+    count('ssh_bytes', len(result), command='sinfo')
+    check_exit_status('sinfo', stdout, stderr)
+
+    nodes = {}
+    for line in result.decode().splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 3:
+            continue
+        node, cpus, gres = fields
+        allocated, idle, other, total = (int(value) for value in cpus.split('/'))
+        gpus = sum(int(number) for number in re.findall(r'gpu(?::[^:,(]+)?:(\d+)', gres))
+        # Nodes in several partitions are listed once per partition
+        nodes[node] = (allocated, total, gpus)
+    return nodes
+
+
+# State of the cluster at one poll: the running jobs and the (CPUs, GPUs) allocated to each user and node
+class LiveSnapshot:
+    def __init__(self, version, jobs, nodes):
+        self.version = version
+        self.polled_at = time.time()
+        self.time = datetime.now()
+        self.jobs = jobs
+
+        self.users = {}
+        gpus_per_node = {}
+        for user, account, cpus, gpus, job_nodes in jobs.values():
+            user_cpus, user_gpus = self.users.get(user, (0, 0))
+            self.users[user] = (user_cpus + cpus, user_gpus + gpus)
+            # The GPUs of a multi-node job are counted evenly on its nodes
+            for node in job_nodes:
+                gpus_per_node[node] = gpus_per_node.get(node, 0) + gpus / len(job_nodes)
+        self.nodes = {node: (allocated, round(gpus_per_node.get(node, 0))) for node, (allocated, total, gpus) in nodes.items()}
+        self.capacity = {node: (total, gpus) for node, (allocated, total, gpus) in nodes.items()}
+
+    # This function returns the (CPUs, GPUs) allocated on the cluster and its (CPUs, GPUs)
+    def totals(self):
+        allocated = tuple(sum(values) for values in zip((0, 0), *self.nodes.values()))
+        capacity = tuple(sum(values) for values in zip((0, 0), *self.capacity.values()))
+        return allocated, capacity
+
+
+# Function to get the ids of the jobs that started and of the jobs that ended between two snapshots
+def job_changes(previous, latest):
+    started = [job_id for job_id in latest.jobs if job_id not in previous.jobs]
+    ended = [job_id for job_id in previous.jobs if job_id not in latest.jobs]
+    return started, ended
+
+
+# Polls squeue and sinfo for every dashboard of a login at once. The first request after LIVE_POLL_INTERVAL seconds polls
+# the cluster with its own SSH connection while the others are served the latest snapshot, so N open dashboards cause one
+# poll per interval. With a shared state directory, the snapshots are kept there and the poll is leased to one worker process
+# for the interval, so that this also holds across the workers; otherwise they are kept in the memory of the process.
+# Snapshot versions are random ids, unique across processes; the timeline lists them in the order they were polled.
+class LivePoller:
+    def __init__(self, login='', shared=None, interval=LIVE_POLL_INTERVAL, history=LIVE_HISTORY):
+        self.login = login
+        self.interval = interval
+        self.history = history
+        self._shared = shared
+        self._local = {}
+        self._polling = False
+        self._lock = threading.Lock()
+
+    # This function returns the latest snapshot, after polling the cluster if it is outdated, or None before the first poll
+    def latest(self, ssh):
+        last = self._latest()
+        due = last is None or time.time() - last.polled_at >= self.interval
+        if due and self._claim():
+            try:
+                self._poll(ssh)
+            except Exception as e:
+                print(f"Error polling the cluster: {e}")
+            finally:
+                with self._lock:
+                    self._polling = False
+        return self._latest()
+
+    # This function reserves the next poll for this thread: one thread per process, and one process per interval
+    def _claim(self):
+        with self._lock:
+            if self._polling:
+                return False
+            self._polling = True
+        if self._shared is None or self._shared.add((self.login, 'lease'), os.getpid(), expire=self.interval):
+            return True
+        with self._lock:
+            self._polling = False
+        return False
+
+    def _poll(self, ssh):
+        with span('live_poll'):
+            jobs = fetch_running_jobs(ssh)
+            nodes = fetch_nodes(ssh)
+        snapshot = LiveSnapshot(uuid.uuid4().hex, jobs, nodes)
+
+        # Only the process holding the lease writes, so the timeline is not updated concurrently
+        timeline = self.timeline() + [(snapshot.version, snapshot.time, snapshot.totals()[0])]
+        for version, polled_time, allocated in timeline[:-self.history]:
+            self._delete(('snapshot', version))
+        self._set(('snapshot', snapshot.version), snapshot)
+        self._set('timeline', timeline[-self.history:])
+        self._set('latest', snapshot.version)
+
+    def _latest(self):
+        version = self._get('latest')
+        return self.get(version) if version else None
+
+    # This function returns the snapshot of a version, or None if it is no longer kept
+    def get(self, version):
+        return self._get(('snapshot', version))
+
+    # This function returns the (version, time, (allocated CPUs, allocated GPUs)) of the snapshots kept, from the oldest to the latest
+    def timeline(self):
+        return self._get('timeline') or []
+
+    def _get(self, key):
+        store = self._local if self._shared is None else self._shared
+        return store.get((self.login, key))
+
+    def _set(self, key, value):
+        if self._shared is None:
+            with self._lock:
+                self._local[(self.login, key)] = value
+        else:
+            self._shared.set((self.login, key), value)
+
+    def _delete(self, key):
+        if self._shared is None:
+            with self._lock:
+                self._local.pop((self.login, key), None)
+        else:
+            self._shared.delete((self.login, key))
+
+
+# Snapshots shared by the worker processes, when there is a shared state directory
+live_state = open_shared_cache('live')
+
+# Pollers of the cluster, one per login: squeue only lists the jobs a login is allowed to see (PrivateData),
+# so the snapshot polled with one login is only shown to the sessions of that login
+live_pollers = {}
+live_pollers_lock = threading.Lock()
+
+
+# Function to get the poller of a login
+def live_poller_of(login):
+    with live_pollers_lock:
+        if login not in live_pollers:
+            live_pollers[login] = LivePoller(login, live_state)
+        return live_pollers[login]
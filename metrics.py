@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context
+
+# Upper bounds, in seconds, of the buckets of the span duration histogram
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')]
+
+# Set SLURM_DASHBOARD_TRACE=1 to log every span as a JSON line, with the id of the request it belongs to
+TRACE = os.environ.get('SLURM_DASHBOARD_TRACE', '') not in ('', '0')
+
+logger = logging.getLogger('slurm_dashboard.trace')
+
+_lock = threading.Lock()
+# Request id of the background threads working for a request
+_local = threading.local()
+# (span, labels) -> [bucket counts, sum of durations, count]
+_histograms = {}
+# (counter, labels) -> value
+_counters = {}
+
+
+# Function to get an id for the current request, used to group the spans of a request in the logs
+def request_id():
+    if not has_request_context():
+        return getattr(_local, 'request_id', None)
+    if 'request_id' not in g:
+        g.request_id = os.urandom(8).hex()
+    return g.request_id
+
+
+# Context manager attributing the spans of a background thread to the request that started its work
+@contextmanager
+def traced(request):
+    previous = getattr(_local, 'request_id', None)
+    _local.request_id = request
+    try:
+        yield
+    finally:
+        _local.request_id = previous
+
+
+# Function to record the duration of a span
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.setdefault(key, [[0] * len(BUCKETS), 0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[0][i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+# Function to get the seconds spent in a span so far, summed over its labels
+def span_seconds(name):
+    with _lock:
+        return sum(histogram[1] for (span_name, labels), histogram in _histograms.items() if span_name == name)
+
+
+# Function to add a value (rows, bytes...) to a counter
+def count(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+# Context manager timing the code it wraps as the span name
+@contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe(name, seconds, **labels)
+        if TRACE:
+            logger.info(json.dumps({'request_id': request_id(), 'span': name, 'seconds': round(seconds, 6), **labels}))
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+# Function to render every metric in the Prometheus text exposition format.
+# gauges and totals are dicts of additional {name: value} gauges and counters read at scrape time (e.g. cache statistics).
+def render(gauges=None, totals=None):
+    lines = [
+        '# HELP slurm_dashboard_span_seconds Duration of the instrumented operations.',
+        '# TYPE slurm_dashboard_span_seconds histogram',
+    ]
+    with _lock:
+        histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in _histograms.items())
+        counters = sorted(_counters.items())
+
+    for (name, labels), (buckets, total, number) in histograms:
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'slurm_dashboard_span_seconds_bucket{_format_labels(labels, span=name, le=le)} {bucket_count}')
+        lines.append(f'slurm_dashboard_span_seconds_sum{_format_labels(labels, span=name)} {total}')
+        lines.append(f'slurm_dashboard_span_seconds_count{_format_labels(labels, span=name)} {number}')
+
+    names = []
+    for (name, labels), value in counters:
+        if name not in names:
+            names.append(name)
+            lines.append(f'# TYPE slurm_dashboard_{name}_total counter')
+        lines.append(f'slurm_dashboard_{name}_total{_format_labels(labels)} {value}')
+
+    for name, value in (totals or {}).items():
+        lines.append(f'# TYPE slurm_dashboard_{name}_total counter')
+        lines.append(f'slurm_dashboard_{name}_total {value}')
+
+    for name, value in (gauges or {}).items():
+        lines.append(f'# TYPE slurm_dashboard_{name} gauge')
+        lines.append(f'slurm_dashboard_{name} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,38 @@
+import os
+import threading
+from flask import session, has_request_context
+from ssh_connection import ConnectionManager
+from user_directory import UserDirectory
+from shared_state import open_shared_cache
+
+ssh_host = "simlab-cluster.um6p.ma"
+
+# Secret key of the session cookies, shared by the login pages and the dashboard. Every worker process must use the same key.
+# The default key is only meant for the development server: wsgi.py refuses to start with it.
+DEFAULT_SECRET_KEY = 'software_engineer'
+SECRET_KEY = os.environ.get('SLURM_DASHBOARD_SECRET_KEY', DEFAULT_SECRET_KEY)
+
+# SSH connections of the logged-in sessions. Each browser session gets its own pool of connections.
+# With a shared state directory, the sessions are also recorded there so that every worker process can serve them.
+connections = ConnectionManager(ssh_host, registry=open_shared_cache('sessions'))
+
+# Users and accounts of the cluster, one directory per login as sacctmgr only lists the associations a login may see.
+# Each directory is refreshed in the background and shared by the sessions of its login.
+user_directories = {}
+user_directories_lock = threading.Lock()
+
+
+# Function to get the SSH connection of the current browser session.
+# Dash also calls the layout function outside of any request to validate it; there is no connection then.
+def get_ssh():
+    if not has_request_context():
+        return None
+    return connections.get(session.get('ssh_session'), session.get('ssh_key'))
+
+
+# Function to get the user directory of a login
+def user_directory_of(login):
+    with user_directories_lock:
+        if login not in user_directories:
+            user_directories[login] = UserDirectory()
+        return user_directories[login]
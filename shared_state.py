@@ -0,0 +1,56 @@
+import fcntl
+import os
+import threading
+import time
+
+# Directory of the state shared by the worker processes of a production deployment (see wsgi.py): the logged-in sessions,
+# the cached query results and the slots limiting the concurrent queries. When it is not set, this state stays in the memory
+# of the process, which is enough for the development server.
+STATE_DIR = os.environ.get('SLURM_DASHBOARD_STATE_DIR')
+
+
+# Function to open a process-safe cache named name in the shared state directory, or None when there is no shared state.
+# settings are passed to diskcache.Cache (size_limit, eviction_policy...).
+def open_shared_cache(name, **settings):
+    if not STATE_DIR:
+        return None
+    import diskcache
+    return diskcache.Cache(os.path.join(STATE_DIR, name), **settings)
+
+
+# Seconds between two attempts to take a slot when they are all taken
+SLOT_WAIT = 0.1
+
+
+# Semaphore shared by the worker processes: each slot is a file of the shared state directory, taken by locking it (flock).
+# A slot is freed when its holder releases it or exits, so a crashed worker does not leak it.
+class SharedSlots:
+    def __init__(self, path, slots):
+        os.makedirs(path, exist_ok=True)
+        self.paths = [os.path.join(path, f'slot-{i}.lock') for i in range(slots)]
+        self._held = threading.local()
+
+    def __enter__(self):
+        while True:
+            for path in self.paths:
+                slot = open(path, 'a')
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    slot.close()
+                    continue
+                self._held.__dict__.setdefault('slots', []).append(slot)
+                return self
+            time.sleep(SLOT_WAIT)
+
+    def __exit__(self, *exc_info):
+        # Closing the file releases the lock
+        self._held.slots.pop().close()
+
+
+# Function to create a semaphore of slots named name: shared by the worker processes when there is a shared state directory,
+# local to the process otherwise
+def open_shared_slots(name, slots):
+    if not STATE_DIR:
+        return threading.BoundedSemaphore(slots)
+    return SharedSlots(os.path.join(STATE_DIR, name), slots)
@@ -1,12 +1,220 @@
+import secrets
+import threading
+import time
 import paramiko
+from cryptography.fernet import Fernet, InvalidToken
+from metrics import span, count
+
+# Number of authenticated transports kept per logged-in session. Commands are spread over them round-robin,
+# and each transport multiplexes the channels opened by exec_command.
+MAX_CONNECTIONS_PER_SESSION = 2
+
+# Seconds between SSH keepalive packets on idle transports
+KEEPALIVE_INTERVAL = 60
+
+# Seconds after which a session that ran no command is closed
+SESSION_TIMEOUT = 8 * 3600
+
+# Minimum number of seconds between two checks for expired sessions
+EXPIRY_CHECK_INTERVAL = 60
+
 
 # Function to establish the ssh connection
 def establish_ssh_connection(ssh_host, ssh_username, ssh_password):
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
-        ssh.connect(ssh_host, username=ssh_username, password=ssh_password)
+        with span('ssh_connect'):
+            ssh.connect(ssh_host, username=ssh_username, password=ssh_password)
+        ssh.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
         return ssh
     except Exception as e:
         print(f"Error connecting to {ssh_host}: {e}")
         return None
+
+
+# Check that the transport of a client is still usable
+def is_healthy(ssh):
+    transport = ssh.get_transport()
+    return transport is not None and transport.is_active()
+
+
+# This function raises an error if a command executed over SSH exited with a non-zero status
+def check_exit_status(name, stdout, stderr):
+    status = stdout.channel.recv_exit_status()
+    if status != 0:
+        error = stderr.read().decode(errors='replace').strip()
+        count('ssh_errors', command=name)
+        raise RuntimeError(f"{name} exited with status {status}: {error}")
+
+
+# Bounded pool of SSH connections of one logged-in session.
+# It exposes exec_command like paramiko.SSHClient, so it can be passed wherever a client is expected.
+class SessionConnection:
+    def __init__(self, host, username, password, max_connections=MAX_CONNECTIONS_PER_SESSION):
+        self.host = host
+        self.username = username
+        self._password = password
+        self.max_connections = max_connections
+        self._clients = []
+        self._next = 0
+        # Number of connections being opened
+        self._opening = 0
+        self._lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    # This function opens the first connection of the pool. It returns False if authentication fails
+    def open(self):
+        ssh = establish_ssh_connection(self.host, self.username, self._password)
+        if ssh is None:
+            return False
+        self._clients.append(ssh)
+        return True
+
+    # This function returns the next connection of the pool, opening a new one while the pool is not full
+    # and replacing the ones whose transport is no longer active. Connections are opened outside the lock,
+    # so that a slow or unreachable host does not block the commands sent over the other connections.
+    def _acquire(self):
+        with self._lock:
+            self.last_used = time.monotonic()
+            grow = len(self._clients) + self._opening < self.max_connections
+            if grow:
+                self._opening += 1
+        if grow:
+            ssh = establish_ssh_connection(self.host, self.username, self._password)
+            with self._lock:
+                self._opening -= 1
+                if ssh is not None:
+                    self._clients.append(ssh)
+                    return ssh
+
+        with self._lock:
+            if not self._clients:
+                raise paramiko.SSHException(f"No connection to {self.host}")
+            ssh = self._clients[self._next % len(self._clients)]
+            self._next += 1
+        if is_healthy(ssh):
+            return ssh
+
+        ssh.close()
+        replacement = establish_ssh_connection(self.host, self.username, self._password)
+        with self._lock:
+            if ssh in self._clients:
+                self._clients.remove(ssh)
+            if replacement is not None and len(self._clients) + self._opening < self.max_connections:
+                self._clients.append(replacement)
+                return replacement
+            # The pool was refilled by other commands meanwhile, or the host could not be reached
+            other = self._clients[0] if self._clients else None
+        if replacement is not None:
+            replacement.close()
+        if other is None:
+            raise paramiko.SSHException(f"Could not reconnect to {self.host}")
+        return other
+
+    def exec_command(self, command):
+        return self._acquire().exec_command(command)
+
+    def close(self):
+        with self._lock:
+            for ssh in self._clients:
+                ssh.close()
+            self._clients = []
+
+
+# Keeps the SSH connections of every logged-in session, indexed by a random session id.
+# SSH connections cannot be shared between processes: when several worker processes serve the dashboard,
+# the sessions are recorded in a shared registry (a diskcache.Cache) and each process opens its own connections.
+class ConnectionManager:
+    def __init__(self, host, session_timeout=SESSION_TIMEOUT, registry=None):
+        self.host = host
+        self.session_timeout = session_timeout
+        self.registry = registry
+        self._sessions = {}
+        self._expiry_checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # This function authenticates a new session. It returns its id and the key of its credentials, or (None, None)
+    # if the connection failed. With a registry, the password is saved there encrypted with the key, and the key is only
+    # kept in the browser session: it is needed by the other processes to open connections for the session.
+    def open_session(self, username, password):
+        self.close_expired_sessions()
+        connection = SessionConnection(self.host, username, password)
+        if not connection.open():
+            return None, None
+
+        session_id = secrets.token_urlsafe(32)
+        key = None
+        if self.registry is not None:
+            key = Fernet.generate_key().decode()
+            self.registry.set(session_id, (username, Fernet(key).encrypt(password.encode())), expire=self.session_timeout)
+        with self._lock:
+            self._sessions[session_id] = connection
+        return session_id, key
+
+    # This function returns the connection of a session, or None if the session is unknown, closed or expired.
+    # A session opened by another process is connected with the credentials of the registry, decrypted with the key.
+    # The expired sessions are closed here as well, at most every EXPIRY_CHECK_INTERVAL seconds, so that the sessions
+    # of browsers that never come back do not keep their connections open.
+    def get(self, session_id, key=None):
+        if not session_id:
+            return None
+        with self._lock:
+            check_expiry = time.monotonic() - self._expiry_checked_at >= EXPIRY_CHECK_INTERVAL
+            if check_expiry:
+                self._expiry_checked_at = time.monotonic()
+        if check_expiry:
+            self.close_expired_sessions()
+
+        if self.registry is not None:
+            record = self.registry.get(session_id)
+            if record is None:
+                # Logged out, or expired, in another process
+                self._close_local(session_id)
+                return None
+            self.registry.touch(session_id, expire=self.session_timeout)
+
+        with self._lock:
+            connection = self._sessions.get(session_id)
+        if connection is not None and time.monotonic() - connection.last_used > self.session_timeout:
+            self._close_local(session_id)
+            connection = None
+        if connection is not None or self.registry is None or key is None:
+            return connection
+
+        username, token = record
+        try:
+            password = Fernet(key).decrypt(token).decode()
+        except (InvalidToken, ValueError):
+            return None
+        connection = SessionConnection(self.host, username, password)
+        if not connection.open():
+            return None
+
+        with self._lock:
+            existing = self._sessions.setdefault(session_id, connection)
+        if existing is not connection:
+            connection.close()
+        return existing
+
+    def close_session(self, session_id):
+        if self.registry is not None and session_id:
+            self.registry.delete(session_id)
+        self._close_local(session_id)
+
+    def _close_local(self, session_id):
+        with self._lock:
+            connection = self._sessions.pop(session_id, None)
+        if connection:
+            connection.close()
+
+    # This function closes the sessions that did not run any command during the last session_timeout seconds.
+    # With a registry, only the connections of this process are closed: the session may still be used by other processes,
+    # and its record expires on its own.
+    def close_expired_sessions(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, connection in self._sessions.items()
+                       if now - connection.last_used > self.session_timeout]
+        for session_id in expired:
+            self._close_local(session_id)
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The modules are imported from the repository root, and the local database of the tests is kept out of it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SLURM_DASHBOARD_DB', os.path.join(tempfile.mkdtemp(prefix='slurm_dashboard_tests_'), 'usage_store.sqlite'))
@@ -0,0 +1,64 @@
+import io
+import pytest
+from live_status import expand_hostlist, fetch_running_jobs, fetch_nodes, LiveSnapshot
+
+# Output of the dashboard's squeue command: every field is padded to its size and followed by '|'
+SQUEUE_LINES = ''.join(
+    f"{job_id:<64}|{user:<64}|{account:<64}|{tres:<512}|{nodes:<4096}|\n"
+    for job_id, user, account, tres, nodes in [
+        ('1234567', 'alice', 'physics', 'cpu=32,mem=128G,node=2,billing=32,gres/gpu=4', 'gpu[01-02]'),
+        ('1234568_3', 'bob', 'chem', 'cpu=4,mem=16G,node=1,billing=4', 'cpu07'),
+    ]
+)
+
+# Output of the dashboard's sinfo command: a node in two partitions is listed twice
+SINFO_LINES = """\
+cpu07|4/60/0/64|(null)
+gpu01|16/48/0/64|gpu:a100:4(S:0-1)
+gpu01|16/48/0/64|gpu:a100:4(S:0-1)
+gpu02|16/48/0/64|gpu:a100:4(S:0-1)
+"""
+
+
+# Stand-in for the SSH connection answering the live commands with canned output and an exit status
+class LiveSSH:
+    def __init__(self, status=0):
+        self.status = status
+        self.commands = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        output = SQUEUE_LINES if command.startswith('squeue') else SINFO_LINES
+        stdout = io.BytesIO(output.encode() if self.status == 0 else b'')
+        stdout.channel = type('Channel', (), {'recv_exit_status': lambda channel: self.status})()
+        return io.BytesIO(), stdout, io.BytesIO(b'slurm_load_jobs error: Unable to contact slurm controller')
+
+
+def test_expand_hostlist():
+    assert expand_hostlist('node[01-03,07],gpu1') == ['node01', 'node02', 'node03', 'node07', 'gpu1']
+    assert expand_hostlist('rack[1-2]-n[8-9]') == ['rack1-n8', 'rack1-n9', 'rack2-n8', 'rack2-n9']
+
+
+def test_parse_live_output():
+    ssh = LiveSSH()
+    jobs = fetch_running_jobs(ssh)
+    nodes = fetch_nodes(ssh)
+    # The '|' of the formats must reach squeue and sinfo, not the remote shell
+    assert all("'" in command for command in ssh.commands)
+    assert jobs == {
+        '1234567': ('alice', 'physics', 32, 4, ['gpu01', 'gpu02']),
+        '1234568_3': ('bob', 'chem', 4, 0, ['cpu07']),
+    }
+    assert nodes == {'cpu07': (4, 64, 0), 'gpu01': (16, 64, 4), 'gpu02': (16, 64, 4)}
+
+    snapshot = LiveSnapshot('v1', jobs, nodes)
+    assert snapshot.users == {'alice': (32, 4), 'bob': (4, 0)}
+    assert snapshot.nodes == {'cpu07': (4, 0), 'gpu01': (16, 2), 'gpu02': (16, 2)}
+    assert snapshot.totals() == ((36, 4), (192, 8))
+
+
+def test_failed_command_raises():
+    with pytest.raises(RuntimeError, match='squeue exited with status 1'):
+        fetch_running_jobs(LiveSSH(status=1))
+    with pytest.raises(RuntimeError, match='sinfo exited with status 1'):
+        fetch_nodes(LiveSSH(status=1))
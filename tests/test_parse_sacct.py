@@ -0,0 +1,47 @@
+import io
+import numpy as np
+import pandas as pd
+from collect_data import parse_sacct_output, read_sacct_batches
+
+# Output of the dashboard's sacct command, as printed by sacct: the allocation line of each job, including array and
+# heterogeneous jobs and a job cancelled while pending, followed by the lines of its batch, extern and srun steps.
+# The usage (TotalCPU, and the GPU utilization in TRESUsageInAve) is measured by the steps.
+SACCT_LINES = """\
+1234567|alice|physics|16|billing=16,cpu=16,gres/gpu:a100=2,gres/gpu=2,mem=64G,node=1|2024-03-01T10:00:00|5400|2024-03-01T09:12:44|1-00:11:32|
+1234567.batch||physics|16|cpu=16,gres/gpu:a100=2,gres/gpu=2,mem=64G,node=1|2024-03-01T10:00:00|5400|2024-03-01T10:00:00|00:01:02|cpu=00:01:02,energy=0,fs/disk=2334,gres/gpumem=1024M,gres/gpuutil=10,mem=5420K,pages=0,vmem=0
+1234567.extern||physics|16|billing=16,cpu=16,gres/gpu:a100=2,gres/gpu=2,mem=64G,node=1|2024-03-01T10:00:00|5400|2024-03-01T10:00:00|00:00:00.002|cpu=00:00:00,energy=0,fs/disk=5273,gres/gpumem=0,gres/gpuutil=0,mem=0,pages=0,vmem=0
+1234567.0||physics|16|cpu=16,gres/gpu:a100=2,gres/gpu=2,mem=64G,node=1|2024-03-01T10:10:00|1800|2024-03-01T10:10:00|1-00:10:30|cpu=1-00:10:30,energy=0,fs/disk=18237,gres/gpumem=39G,gres/gpuutil=70,mem=12G,pages=3,vmem=14G
+1234568_3|bob|chem|4|billing=4,cpu=4,mem=16G,node=1|2024-03-01T23:30:00|7200|2024-03-01T23:29:58|05:02:03|
+1234568_3.batch||chem|4|cpu=4,mem=16G,node=1|2024-03-01T23:30:00|7200|2024-03-01T23:30:00|05:02:03.512|cpu=05:02:03,energy=0,fs/disk=2012,mem=1128K,pages=0,vmem=0
+1234568_3.extern||chem|4|billing=4,cpu=4,mem=16G,node=1|2024-03-01T23:30:00|7200|2024-03-01T23:30:00|00:00:00|cpu=00:00:00,energy=0,fs/disk=2012,mem=0,pages=0,vmem=0
+1234569|carol|chem|8|billing=8,cpu=8,mem=32G,node=1|Unknown|0|2024-03-02T08:00:00|00:00:00|
+1234570+0|dave|physics|2|billing=2,cpu=2,mem=8G,node=1|2024-03-02T01:00:00|60|2024-03-02T00:59:00|00:00:00|
+"""
+
+
+def test_parse_sacct_lines():
+    jobs = parse_sacct_output(SACCT_LINES).set_index('JobID')
+    assert jobs.index.tolist() == ['1234567', '1234568_3', '1234570+0']
+    assert jobs.loc['1234567', 'End'] == pd.Timestamp('2024-03-01T11:30:00')
+    assert jobs.loc['1234567', 'Submit'] == pd.Timestamp('2024-03-01T09:12:44')
+    assert jobs.loc['1234567', ['NumGPUs', 'MemMB', 'NumNodes', 'Billing']].tolist() == [2, 65536, 1, 16]
+    assert jobs.loc['1234568_3', 'End'] == pd.Timestamp('2024-03-02T01:30:00')
+    # The CPU time of the steps is summed; the jobs without steps used none
+    assert jobs['TotalCPU'].tolist() == [62 + 87030, 18124, 0]
+    # Averaged over the run time of the batch and srun steps; the extern step runs no task
+    assert jobs.loc['1234567', 'GPUUtil'] == (10 * 5400 + 70 * 1800) / (5400 + 1800)
+    # The GPU utilization is only kept for the jobs with GPUs
+    assert jobs['GPUUtil'].iloc[1:].isna().all()
+
+
+def test_parse_empty_output():
+    jobs = parse_sacct_output('')
+    assert jobs.empty and {'TotalCPU', 'GPUUtil'} <= set(jobs.columns)
+
+
+def test_steps_are_kept_with_their_job_across_chunks():
+    expected = parse_sacct_output(SACCT_LINES).reset_index(drop=True)
+    for chunk_size in [1, 50, 300, 1000, 1 << 20]:
+        batches = list(read_sacct_batches(io.BytesIO(SACCT_LINES.encode()), chunk_size=chunk_size))
+        jobs = pd.concat(batches).reset_index(drop=True)
+        pd.testing.assert_frame_equal(jobs, expected, check_dtype=False)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import generate_sacct_output
+from collect_data import SACCT_FIELDS, split_jobs_by_day, expand_job, parse_sacct_output
+
+
+# Function to build a DataFrame of parsed jobs from (Start, End) pairs
+def make_jobs(periods, num_gpus=0):
+    start = pd.to_datetime([period[0] for period in periods])
+    end = pd.to_datetime([period[1] for period in periods])
+    return pd.DataFrame({
+        'JobID': [str(1000 + i) for i in range(len(periods))],
+        'User': 'user0',
+        'Account': 'account0',
+        'AllocCPUS': 4,
+        'AllocTRES': 'cpu=4,mem=16G,node=1,billing=4',
+        'Start': start,
+        'End': end,
+        'NumGPUs': num_gpus,
+        'MemMB': 16384.0,
+    })
+
+
+# Function to split the jobs with the row-by-row reference implementation, in the columns of split_jobs_by_day
+def reference_split(jobs):
+    reference = pd.DataFrame([item for _, row in jobs.iterrows() for item in expand_job(row)],
+                             columns=['JobID', 'Date', 'ElapsedTime', 'NumGPUs'])
+    reference['Date'] = pd.to_datetime(reference['Date'])
+    reference['ElapsedSeconds'] = reference['ElapsedTime'].dt.total_seconds().astype(np.int64)
+    return reference
+
+
+# Function to check that both implementations give the same job-days, and return them
+def assert_parity(jobs):
+    vectorized = split_jobs_by_day(jobs)
+    reference = reference_split(jobs)
+    columns = ['JobID', 'Date', 'ElapsedSeconds', 'NumGPUs']
+    pd.testing.assert_frame_equal(vectorized[columns].reset_index(drop=True), reference[columns], check_dtype=False)
+    return vectorized
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_generated_jobs(seed):
+    jobs = parse_sacct_output(generate_sacct_output(5000, seed=seed)).reset_index(drop=True)
+    vectorized = assert_parity(jobs)
+    # Every second of every job is in exactly one day
+    assert vectorized['ElapsedSeconds'].sum() == (jobs['End'] - jobs['Start']).dt.total_seconds().sum()
+
+
+def test_midnight_aligned_jobs():
+    jobs = make_jobs([
+        ('2024-01-01T00:00:00', '2024-01-02T00:00:00'),
+        ('2024-01-01T12:00:00', '2024-01-02T00:00:00'),
+        ('2024-01-01T00:00:00', '2024-01-01T06:00:00'),
+        ('2024-01-01T00:00:00', '2024-01-03T00:00:00'),
+    ])
+    vectorized = assert_parity(jobs)
+    assert vectorized.groupby('JobID')['ElapsedSeconds'].apply(list).to_dict() == {
+        '1000': [86400], '1001': [43200], '1002': [21600], '1003': [86400, 86400]}
+    # A job ending at midnight has no row on the next day
+    assert vectorized['Date'].max() == pd.Timestamp('2024-01-02')
+
+
+def test_multi_day_jobs():
+    jobs = make_jobs([
+        ('2024-01-30T22:00:00', '2024-02-02T01:30:00'),
+        ('2024-02-28T23:59:59', '2024-03-01T00:00:01'),
+        ('2023-12-31T18:00:00', '2024-01-07T06:00:00'),
+    ], num_gpus=2)
+    vectorized = assert_parity(jobs)
+    assert vectorized.groupby('JobID').size().to_dict() == {'1000': 4, '1001': 3, '1002': 8}
+    assert (vectorized['NumGPUs'] == 2).all()
+
+
+def test_zero_length_jobs():
+    jobs = make_jobs([
+        ('2024-01-01T10:00:00', '2024-01-01T10:00:00'),
+        ('2024-01-02T00:00:00', '2024-01-02T00:00:00'),
+        ('2024-01-03T10:00:00', '2024-01-03T11:00:00'),
+    ])
+    vectorized = assert_parity(jobs)
+    assert vectorized['JobID'].tolist() == ['1002']
+
+
+def test_unfinished_jobs():
+    # A job that never started has no run time and is dropped by the parser; a running job is split up to its run time so far
+    lines = [
+        {'JobID': '1000', 'Start': 'Unknown', 'ElapsedRaw': '0'},
+        {'JobID': '1001', 'Start': '2024-01-01T21:00:00', 'ElapsedRaw': str(2 * 86400 + 5 * 3600)},
+    ]
+    defaults = {'User': 'user0', 'Account': 'account0', 'AllocCPUS': '4', 'AllocTRES': 'cpu=4,mem=16G,node=1,billing=4'}
+    output = ''.join('|'.join({**defaults, **line}.get(field, '') for field in SACCT_FIELDS) + '\n' for line in lines)
+    jobs = parse_sacct_output(output).reset_index(drop=True)
+    assert jobs['JobID'].tolist() == ['1001']
+
+    vectorized = assert_parity(jobs)
+    assert vectorized['ElapsedSeconds'].tolist() == [3 * 3600, 86400, 86400, 2 * 3600]
+    assert vectorized['Date'].max() == pd.Timestamp('2024-01-04')
+
+
+def test_empty_jobs():
+    vectorized = split_jobs_by_day(make_jobs([]))
+    assert vectorized.empty
+    assert list(vectorized.columns) == ['JobID', 'User', 'Account', 'AllocCPUS', 'AllocTRES', 'Date', 'ElapsedSeconds', 'NumGPUs', 'MemMB']
@@ -0,0 +1,10 @@
+from benchmark import STARTUP_BUDGET_S, profile_startup
+
+
+# The login page is served in a fresh interpreter within the budget, without loading Dash, plotly or pandas,
+# and the first request to /dashboard/ then builds the dashboard
+def test_login_page_startup():
+    profile, violations = profile_startup()
+    assert profile['login_page_s'] <= STARTUP_BUDGET_S
+    assert profile['dashboard_modules_loaded'] == []
+    assert violations == []
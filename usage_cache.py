@@ -0,0 +1,163 @@
+from collections import OrderedDict
+import threading
+import time
+from shared_state import open_shared_cache
+
+# Upper bound on the memory used by the cached results
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Number of seconds a result covering today stays valid: jobs keep finishing until the end of the day
+RECENT_TTL = 60
+
+
+# Size in bytes of a cached value (DataFrames are measured with their memory usage)
+def sizeof(value):
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+
+# In-process cache of query results with a per-entry TTL and a memory-bounded LRU eviction.
+# Entries added with ttl=None never expire and are only removed when the cache is full or invalidated.
+class UsageCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # This function returns the cached value for the key, or None if it is missing or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # This function stores the value for the key, evicting the least recently used entries if needed
+    def put(self, key, value, ttl=None):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    # This function removes the entries whose key matches, e.g. the results covering days whose usage changed
+    def invalidate(self, match):
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self._remove(key)
+            self.invalidations += 1
+
+    # This function returns the number of invalidations so far: a result computed while it changed may already be outdated
+    def generation(self):
+        with self._lock:
+            return self.invalidations
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        value, size, expires_at = self._entries.pop(key)
+        self.size -= size
+
+    # Counters used to size the cache under real load
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+# Cache of query results shared by the worker processes, stored in the shared state directory.
+# It has the interface of UsageCache; its LRU eviction and expiration are done by diskcache.
+# The number of invalidations is counted in a separate cache, so that it is never evicted.
+class SharedUsageCache:
+    def __init__(self, cache, counters, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._cache = cache
+        self._counters = counters
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    # Entries are removed here rather than by diskcache when it is full (cull_limit=0), so that they can be counted
+    def put(self, key, value, ttl=None):
+        if sizeof(value) <= self.max_bytes:
+            self._cache.set(key, value, expire=ttl)
+            expired = self._cache.expire()
+            evicted = self._cache.cull()
+            if expired:
+                self._counters.incr('expirations', expired)
+            if evicted:
+                self._counters.incr('evictions', evicted)
+
+    def invalidate(self, match):
+        for key in list(self._cache.iterkeys()):
+            if match(key):
+                self._cache.delete(key)
+        self._counters.incr('invalidations')
+
+    def generation(self):
+        return self._counters.get('invalidations', 0)
+
+    def clear(self):
+        self._cache.clear()
+
+    # Counters used to size the cache under real load, summed over the worker processes
+    def stats(self):
+        hits, misses = self._cache.stats()
+        return {
+            'entries': len(self._cache),
+            'size_bytes': self._cache.volume(),
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': self._counters.get('evictions', 0),
+            'expirations': self._counters.get('expirations', 0),
+            'invalidations': self.generation(),
+        }
+
+
+# Function to create the cache of query results: shared by the worker processes when there is a shared state directory,
+# in the memory of the process otherwise
+def open_usage_cache(max_bytes=CACHE_MAX_BYTES):
+    cache = open_shared_cache('usage_cache', size_limit=max_bytes, eviction_policy='least-recently-used',
+                              cull_limit=0, statistics=True)
+    if cache is None:
+        return UsageCache(max_bytes)
+    return SharedUsageCache(cache, open_shared_cache('usage_cache_counters'), max_bytes)
@@ -0,0 +1,90 @@
+import io
+
+# Export formats: format -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# Number of rows encoded and sent at a time. Each chunk is a row group in Parquet and a record batch in Arrow IPC.
+EXPORT_CHUNK_ROWS = 50000
+
+
+# Write-only file collecting the bytes written by the Arrow and Parquet writers until they are taken and sent.
+# The position keeps counting the bytes already taken, as the Parquet footer refers to the offsets of the row groups.
+class ChunkBuffer(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    # This function returns the bytes written since the last call
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Function to split a dataframe into chunks of at most chunk_rows rows. An empty dataframe gives one empty chunk.
+def row_chunks(dataframe, chunk_rows):
+    for start in range(0, max(len(dataframe), 1), chunk_rows):
+        yield dataframe.iloc[start:start + chunk_rows]
+
+
+def csv_chunks(dataframe, chunk_rows):
+    for i, chunk in enumerate(row_chunks(dataframe, chunk_rows)):
+        yield chunk.to_csv(index=False, header=i == 0, date_format='%Y-%m-%d').encode()
+
+
+def arrow_chunks(dataframe, chunk_rows):
+    import pyarrow as pa
+    schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+    sink = ChunkBuffer()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk in row_chunks(dataframe, chunk_rows):
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.take()
+    yield sink.take()
+
+
+def parquet_chunks(dataframe, chunk_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+    sink = ChunkBuffer()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in row_chunks(dataframe, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.take()
+    yield sink.take()
+
+
+# Function to encode a dataframe in one of the EXPORT_FORMATS, as a generator of byte chunks that can be streamed
+# in the response while the next chunks are encoded. Parquet and Arrow IPC require pyarrow.
+def export_chunks(dataframe, export_format, chunk_rows=EXPORT_CHUNK_ROWS):
+    encoders = {'csv': csv_chunks, 'parquet': parquet_chunks, 'arrow': arrow_chunks}
+    return encoders[export_format](dataframe, chunk_rows)
+
+
+# Function to check whether a format can be exported: Parquet and Arrow IPC are only available when pyarrow is installed
+def is_available(export_format):
+    if export_format not in EXPORT_FORMATS:
+        return False
+    if export_format == 'csv':
+        return True
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,331 @@
+from contextlib import closing, contextmanager, nullcontext
+from datetime import datetime, timedelta
+import fcntl
+import hashlib
+import os
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Location of the local database. It can be moved with the SLURM_DASHBOARD_DB environment variable.
+# Each login has its own database next to it (see login_db_path).
+DEFAULT_DB_PATH = os.environ.get('SLURM_DASHBOARD_DB', 'usage_store.sqlite')
+
+# Minimum number of seconds between two syncs of the same user.
+# Queries made within this interval are served from the local data without contacting the cluster.
+SYNC_INTERVAL = 60
+
+# Seconds before the end of the last sync that are fetched again by the next one.
+# slurmdbd records a job a little after it ends, so a job that ended just before a sync may only be listed by the next one.
+SYNC_MARGIN = 600
+
+# Version of the schema below. A store created with another version is rebuilt from scratch,
+# since everything it holds can be fetched again from the cluster.
+SCHEMA_VERSION = 7
+
+# Jobs are stored once they are finished: their records never change afterwards.
+# Submit, Start, End and Date are stored as seconds since the epoch so that time ranges can use the index.
+# TotalCPU is the CPU time used by the steps, in seconds, and GPUUtil the GPU utilization of the steps in percent (NULL when not measured).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    JobID TEXT PRIMARY KEY,
+    User TEXT NOT NULL,
+    Account TEXT NOT NULL,
+    AllocCPUS INTEGER NOT NULL,
+    AllocTRES TEXT,
+    NumGPUs INTEGER NOT NULL,
+    MemMB INTEGER NOT NULL,
+    NumNodes INTEGER NOT NULL,
+    Billing INTEGER NOT NULL,
+    Start INTEGER NOT NULL,
+    End INTEGER NOT NULL,
+    Submit INTEGER NOT NULL,
+    TotalCPU INTEGER NOT NULL,
+    GPUUtil REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_user_end ON jobs (User, End);
+CREATE INDEX IF NOT EXISTS jobs_end ON jobs (End);
+
+-- Usage of each user and account per day, summed over the stored jobs
+CREATE TABLE IF NOT EXISTS daily_usage (
+    User TEXT NOT NULL,
+    Account TEXT NOT NULL,
+    Date INTEGER NOT NULL,
+    AllocCPUS INTEGER NOT NULL,
+    NumGPUs INTEGER NOT NULL,
+    CPUSeconds INTEGER NOT NULL,
+    GPUSeconds INTEGER NOT NULL,
+    MemSeconds INTEGER NOT NULL,
+    PRIMARY KEY (User, Account, Date)
+);
+CREATE INDEX IF NOT EXISTS daily_usage_date ON daily_usage (Date);
+
+-- GPU usage of each user and account per day and GPU model
+CREATE TABLE IF NOT EXISTS daily_gpu_usage (
+    User TEXT NOT NULL,
+    Account TEXT NOT NULL,
+    Date INTEGER NOT NULL,
+    Model TEXT NOT NULL,
+    NumGPUs INTEGER NOT NULL,
+    GPUSeconds INTEGER NOT NULL,
+    PRIMARY KEY (User, Account, Date, Model)
+);
+CREATE INDEX IF NOT EXISTS daily_gpu_usage_date ON daily_gpu_usage (Date);
+
+-- Every finished job of the user whose End lies in [synced_from, synced_until] is in the jobs table.
+-- The user '*' tracks the syncs made for all users at once
+CREATE TABLE IF NOT EXISTS sync_state (
+    User TEXT PRIMARY KEY,
+    synced_from INTEGER NOT NULL,
+    synced_until INTEGER NOT NULL
+);
+"""
+
+DROP_SCHEMA = """
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS daily_usage;
+DROP TABLE IF EXISTS daily_gpu_usage;
+DROP TABLE IF EXISTS sync_state;
+"""
+
+# Maximum number of parameters passed in a single SQLite query
+QUERY_CHUNK_SIZE = 500
+
+
+# Convert a datetime column or value to seconds since the epoch
+def to_epoch(values):
+    return np.asarray(values, dtype='datetime64[s]').astype(np.int64)
+
+
+# Convert seconds since the epoch back to a datetime
+def from_epoch(seconds):
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
+
+
+# Convert the times of jobs read from the jobs table back to datetimes
+def jobs_from_rows(jobs):
+    for column in ['Submit', 'Start', 'End']:
+        jobs[column] = pd.to_datetime(jobs[column], unit='s')
+    jobs['GPUUtil'] = jobs['GPUUtil'].astype(np.float64)
+    return jobs
+
+
+# Function to get the path of the database of a login, e.g. usage_store.alice.sqlite.
+# Logins that are not plain file names are hashed.
+def login_db_path(login, path=DEFAULT_DB_PATH):
+    root, extension = os.path.splitext(path)
+    name = login if re.fullmatch(r'[A-Za-z0-9_][A-Za-z0-9._-]*', login) else hashlib.sha1(login.encode()).hexdigest()
+    return f"{root}.{name}{extension}"
+
+
+# Local SQLite store of finished job records, synced incrementally per user
+class UsageStore:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.locks_dir = f"{path}.locks"
+        os.makedirs(self.locks_dir, exist_ok=True)
+        with self._connect() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript(DROP_SCHEMA)
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    # Lock held while a user is synced, so that concurrent queries do not fetch the same jobs twice.
+    # It locks a file of the user, so that it works between the threads and the worker processes sharing the database,
+    # and it is released by the system if the process holding it dies.
+    @contextmanager
+    def sync_lock(self, user):
+        path = os.path.join(self.locks_dir, hashlib.sha1(user.encode()).hexdigest() + '.lock')
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    # Transaction holding the write lock of the database, between threads and processes.
+    # Writers check which jobs are new and save them in the same transaction, so that a job is only added once.
+    @contextmanager
+    def writing(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+
+    # This function returns the (start, end) periods that have to be fetched so that
+    # every job of the user that finished between start and now is in the store
+    def missing_ranges(self, user, start, now):
+        with self._connect() as conn:
+            state = conn.execute("SELECT synced_from, synced_until FROM sync_state WHERE User = ?", (user,)).fetchone()
+
+        if state is None:
+            return [(start, now)]
+
+        synced_from = from_epoch(state[0])
+        synced_until = from_epoch(state[1])
+        ranges = []
+        if start < synced_from:
+            ranges.append((start, synced_from))
+        if (now - synced_until).total_seconds() >= SYNC_INTERVAL:
+            ranges.append((max(synced_until - timedelta(seconds=SYNC_MARGIN), synced_from), now))
+        return ranges
+
+    # This function returns the jobs that are not in the store yet, each job once.
+    # conn is the connection of the writing() transaction the jobs are then saved in.
+    def new_jobs(self, jobs, conn=None):
+        jobs = jobs.drop_duplicates('JobID', keep='last')
+        job_ids = jobs['JobID'].tolist()
+        known = []
+        with nullcontext(conn) if conn else self._connect() as conn:
+            for i in range(0, len(job_ids), QUERY_CHUNK_SIZE):
+                chunk = job_ids[i:i + QUERY_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                known += [row[0] for row in conn.execute(f"SELECT JobID FROM jobs WHERE JobID IN ({placeholders})", chunk)]
+        return jobs[~jobs['JobID'].isin(known)]
+
+    # This function saves new jobs and adds their per-day usage to the daily rollups, in a single transaction
+    def add_jobs(self, jobs, daily_usage, gpu_usage, conn=None):
+        rows = zip(
+            jobs['JobID'].tolist(),
+            jobs['User'].tolist(),
+            jobs['Account'].tolist(),
+            jobs['AllocCPUS'].tolist(),
+            jobs['AllocTRES'].tolist(),
+            jobs['NumGPUs'].tolist(),
+            jobs['MemMB'].tolist(),
+            jobs['NumNodes'].tolist(),
+            jobs['Billing'].tolist(),
+            to_epoch(jobs['Start']).tolist(),
+            to_epoch(jobs['End']).tolist(),
+            to_epoch(jobs['Submit']).tolist(),
+            jobs['TotalCPU'].tolist(),
+            jobs['GPUUtil'].tolist(),
+        )
+        daily_rows = zip(
+            daily_usage['User'].tolist(),
+            daily_usage['Account'].tolist(),
+            to_epoch(daily_usage['Date']).tolist(),
+            daily_usage['AllocCPUS'].tolist(),
+            daily_usage['NumGPUs'].tolist(),
+            daily_usage['CPUSeconds'].tolist(),
+            daily_usage['GPUSeconds'].tolist(),
+            daily_usage['MemSeconds'].tolist(),
+        )
+        gpu_rows = zip(
+            gpu_usage['User'].tolist(),
+            gpu_usage['Account'].tolist(),
+            to_epoch(gpu_usage['Date']).tolist(),
+            gpu_usage['Model'].tolist(),
+            gpu_usage['NumGPUs'].tolist(),
+            gpu_usage['GPUSeconds'].tolist(),
+        )
+
+        with nullcontext(conn) if conn else self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                """INSERT INTO daily_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (User, Account, Date) DO UPDATE SET
+                       AllocCPUS = AllocCPUS + excluded.AllocCPUS,
+                       NumGPUs = NumGPUs + excluded.NumGPUs,
+                       CPUSeconds = CPUSeconds + excluded.CPUSeconds,
+                       GPUSeconds = GPUSeconds + excluded.GPUSeconds,
+                       MemSeconds = MemSeconds + excluded.MemSeconds""",
+                daily_rows,
+            )
+            conn.executemany(
+                """INSERT INTO daily_gpu_usage VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (User, Account, Date, Model) DO UPDATE SET
+                       NumGPUs = NumGPUs + excluded.NumGPUs,
+                       GPUSeconds = GPUSeconds + excluded.GPUSeconds""",
+                gpu_rows,
+            )
+
+    # This function extends the synced period of the user once every job of [fetched_from, fetched_until] is saved
+    def mark_synced(self, user, fetched_from, fetched_until):
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO sync_state VALUES (?, ?, ?)
+                   ON CONFLICT (User) DO UPDATE SET
+                       synced_from = MIN(synced_from, excluded.synced_from),
+                       synced_until = MAX(synced_until, excluded.synced_until)""",
+                (user, int(to_epoch(fetched_from)), int(to_epoch(fetched_until))),
+            )
+
+    # This function returns the daily usage of the user, summed over its accounts, for every day of the period [start, end] with usage
+    def load_daily_usage(self, user, start, end):
+        with self._connect() as conn:
+            daily_usage = pd.read_sql_query(
+                """SELECT Date, SUM(AllocCPUS) AS AllocCPUS, SUM(NumGPUs) AS NumGPUs,
+                          SUM(CPUSeconds) AS CPUSeconds, SUM(GPUSeconds) AS GPUSeconds, SUM(MemSeconds) AS MemSeconds
+                   FROM daily_usage WHERE User = ? AND Date BETWEEN ? AND ? GROUP BY Date ORDER BY Date""",
+                conn,
+                params=(user, int(to_epoch(start)), int(to_epoch(end))),
+            )
+
+        daily_usage['Date'] = pd.to_datetime(daily_usage['Date'], unit='s')
+        return daily_usage
+
+    # This function returns the daily usage of every user and account for the period [start, end], or of one user per account
+    def load_cluster_daily_usage(self, start, end, user=None):
+        with self._connect() as conn:
+            daily_usage = pd.read_sql_query(
+                f"""SELECT Date, User, Account, AllocCPUS, NumGPUs, CPUSeconds, GPUSeconds, MemSeconds
+                    FROM daily_usage WHERE Date BETWEEN ? AND ?{' AND User = ?' if user else ''} ORDER BY Date""",
+                conn,
+                params=(int(to_epoch(start)), int(to_epoch(end))) + ((user,) if user else ()),
+            )
+
+        daily_usage['Date'] = pd.to_datetime(daily_usage['Date'], unit='s')
+        return daily_usage
+
+    # This function returns the GPU seconds of the user per day and GPU model, summed over its accounts, for the period [start, end]
+    def load_gpu_usage(self, user, start, end):
+        with self._connect() as conn:
+            gpu_usage = pd.read_sql_query(
+                """SELECT Date, Model, SUM(GPUSeconds) AS GPUSeconds
+                   FROM daily_gpu_usage WHERE User = ? AND Date BETWEEN ? AND ? GROUP BY Date, Model ORDER BY Date""",
+                conn,
+                params=(user, int(to_epoch(start)), int(to_epoch(end))),
+            )
+
+        gpu_usage['Date'] = pd.to_datetime(gpu_usage['Date'], unit='s')
+        return gpu_usage
+
+    # This function returns the GPU seconds of every user and account per day and GPU model for the period [start, end],
+    # or of one user per account
+    def load_cluster_gpu_usage(self, start, end, user=None):
+        with self._connect() as conn:
+            gpu_usage = pd.read_sql_query(
+                f"""SELECT Date, User, Account, Model, GPUSeconds
+                    FROM daily_gpu_usage WHERE Date BETWEEN ? AND ?{' AND User = ?' if user else ''} ORDER BY Date""",
+                conn,
+                params=(int(to_epoch(start)), int(to_epoch(end))) + ((user,) if user else ()),
+            )
+
+        gpu_usage['Date'] = pd.to_datetime(gpu_usage['Date'], unit='s')
+        return gpu_usage
+
+    # This function returns the stored jobs of the user that ran during the period [start, end]
+    def load_jobs(self, user, start, end):
+        with self._connect() as conn:
+            jobs = pd.read_sql_query(
+                "SELECT * FROM jobs WHERE User = ? AND End >= ? AND Start <= ? ORDER BY Start",
+                conn,
+                params=(user, int(to_epoch(start)), int(to_epoch(end))),
+            )
+
+        return jobs_from_rows(jobs)
+
+    # This function returns the jobs of every user that ran during the period [start, end]
+    def load_cluster_jobs(self, start, end):
+        with self._connect() as conn:
+            jobs = pd.read_sql_query(
+                "SELECT * FROM jobs WHERE End >= ? AND Start <= ? ORDER BY Start",
+                conn,
+                params=(int(to_epoch(start)), int(to_epoch(end))),
+            )
+
+        return jobs_from_rows(jobs)
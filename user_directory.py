@@ -0,0 +1,105 @@
+import threading
+import time
+from metrics import span, count
+from ssh_connection import check_exit_status
+
+# Seconds after which the directory is refreshed from slurmdbd. The refresh runs in the background,
+# and the previous list keeps being served until it completes.
+REFRESH_INTERVAL = 15 * 60
+
+# Maximum number of users sent to the browser in the dropdown options; more are found by searching
+MAX_OPTIONS = 100
+
+
+# Function to fetch the users and their accounts from the Slurm associations
+def fetch_associations(ssh):
+    command = "sacctmgr -P -n show associations format=User,Account"
+    with span('ssh_exec', command='sacctmgr'):
+        stdin, stdout, stderr = ssh.exec_command(command)
+    with span('ssh_read', command='sacctmgr'):
+        result = stdout.read()
+    count('ssh_bytes', len(result), command='sacctmgr')
+    # A failed query would otherwise replace the directory with an empty one
+    check_exit_status('sacctmgr', stdout, stderr)
+    result = result.decode()
+
+    accounts = {}
+    for line in result.strip().split('\n'):
+        user, _, account = line.partition('|')
+        # Associations without a user are the accounts themselves
+        if user:
+            accounts.setdefault(user, set()).add(account)
+    return {user: sorted(user_accounts) for user, user_accounts in accounts.items()}
+
+
+# Cached directory of the cluster users and the accounts they belong to, shared by every session
+class UserDirectory:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._accounts = {}
+        self._users = []
+        self._account_names = set()
+        self._loaded_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    # This function loads the directory with the given connection.
+    # The first load is synchronous; afterwards an outdated directory is refreshed in the background.
+    def _ensure_loaded(self, ssh):
+        with self._lock:
+            loaded_at = self._loaded_at
+            if loaded_at is not None and (time.monotonic() - loaded_at < self.refresh_interval or self._refreshing):
+                return
+            if loaded_at is not None:
+                self._refreshing = True
+
+        if loaded_at is None:
+            self._refresh(ssh)
+        else:
+            threading.Thread(target=self._refresh, args=(ssh,), daemon=True).start()
+
+    def _refresh(self, ssh):
+        try:
+            accounts = fetch_associations(ssh)
+        except Exception as e:
+            print(f"Error fetching users: {e}")
+            with self._lock:
+                self._refreshing = False
+            return
+
+        with self._lock:
+            self._accounts = accounts
+            self._users = sorted(accounts)
+            self._account_names = {account for user_accounts in accounts.values() for account in user_accounts}
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+
+    # This function makes the next access reload the directory from slurmdbd
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    # This function returns the accounts of a user
+    def accounts_of(self, ssh, user):
+        self._ensure_loaded(ssh)
+        return self._accounts.get(user, [])
+
+    # This function checks whether an account has associations
+    def has_account(self, ssh, account):
+        self._ensure_loaded(ssh)
+        return account in self._account_names
+
+    # This function returns at most limit users whose name, or the name of one of their accounts, contains the text
+    def search(self, ssh, text='', limit=MAX_OPTIONS):
+        self._ensure_loaded(ssh)
+        with self._lock:
+            users, accounts = self._users, self._accounts
+
+        text = text.lower()
+        matches = []
+        for user in users:
+            if text in user.lower() or any(text in account.lower() for account in accounts[user]):
+                matches.append(user)
+                if len(matches) == limit:
+                    break
+        return matches
@@ -0,0 +1,73 @@
+import os
+import re
+from urllib.parse import urljoin, urlparse
+from urllib.request import Request, urlopen
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stylesheets of the dashboard. Dash serves every file of the assets folder itself and links its stylesheets in the page.
+# Bootstrap is the version of dash_bootstrap_components' themes.BOOTSTRAP, written here so that the login pages,
+# which check whether the stylesheets are vendored, do not import Dash.
+DASHBOARD_STYLESHEETS = {
+    'bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.6/dist/css/bootstrap.min.css',
+    'rubik.css': 'https://fonts.googleapis.com/css2?family=Rubik&display=swap',
+    'fontawesome.css': 'https://use.fontawesome.com/releases/v5.7.2/css/all.css',
+}
+DASHBOARD_VENDOR_DIR = os.path.join(BASE_DIR, 'assets', 'vendor')
+
+# Stylesheets of the login page, served by Flask from the static folder
+LOGIN_STYLESHEETS = {
+    'normalize.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/normalize/5.0.0/normalize.min.css',
+}
+LOGIN_VENDOR_DIR = os.path.join(BASE_DIR, 'static', 'vendor')
+
+# Browser user agent sent with the downloads: Google Fonts only returns woff2 fonts to browsers that support them
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+# Function to check whether local copies of the stylesheets have been downloaded to directory
+def is_vendored(stylesheets, directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in stylesheets)
+
+
+def fetch(url):
+    with urlopen(Request(url, headers={'User-Agent': USER_AGENT}), timeout=30) as response:
+        return response.read()
+
+
+# Function to download a stylesheet to directory/name, with the fonts and images it references.
+# They are saved in directory/files and the stylesheet is rewritten to point to the local copies.
+def download_stylesheet(url, directory, name):
+    files_dir = os.path.join(directory, 'files')
+    os.makedirs(files_dir, exist_ok=True)
+    saved = {}
+
+    def save(match):
+        reference = match.group(2)
+        if reference.startswith('data:'):
+            return match.group(0)
+        file_url = urljoin(url, reference)
+        parsed = urlparse(file_url)
+        file_name = os.path.basename(parsed.path)
+        if file_name not in saved:
+            with open(os.path.join(files_dir, file_name), 'wb') as f:
+                f.write(fetch(parsed._replace(fragment='').geturl()))
+            saved[file_name] = True
+        fragment = f'#{parsed.fragment}' if parsed.fragment else ''
+        return f'url("files/{file_name}{fragment}")'
+
+    css = re.sub(r'url\((["\']?)([^)"\']+)\1\)', save, fetch(url).decode())
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(css)
+
+
+def main():
+    for stylesheets, directory in [(DASHBOARD_STYLESHEETS, DASHBOARD_VENDOR_DIR), (LOGIN_STYLESHEETS, LOGIN_VENDOR_DIR)]:
+        for name, url in stylesheets.items():
+            print(f"Downloading {url}")
+            download_stylesheet(url, directory, name)
+    print("Done. The dashboard now serves its stylesheets and fonts locally.")
+
+
+if __name__ == '__main__':
+    main()
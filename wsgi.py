@@ -0,0 +1,16 @@
+import os
+
+# Production entry point, served by a WSGI server with several worker processes and threads, e.g.:
+#   gunicorn --workers 4 --threads 8 --bind 0.0.0.0:8000 wsgi:app
+# The worker processes share the logged-in sessions and the cached results through the shared state directory
+# (SLURM_DASHBOARD_STATE_DIR), and the synced jobs through the SQLite store (SLURM_DASHBOARD_DB).
+# Set SLURM_DASHBOARD_SECRET_KEY to the same secret for every worker: the default key is public, and anyone knowing it
+# could forge session cookies.
+os.environ.setdefault('SLURM_DASHBOARD_STATE_DIR', 'dashboard_state')
+
+from sessions import SECRET_KEY, DEFAULT_SECRET_KEY  # noqa: E402
+
+if SECRET_KEY == DEFAULT_SECRET_KEY:
+    raise RuntimeError("Set SLURM_DASHBOARD_SECRET_KEY to a random secret before serving the dashboard in production")
+
+from app import app  # noqa: E402